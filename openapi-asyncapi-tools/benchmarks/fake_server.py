@@ -0,0 +1,346 @@
+"""A local stand-in for the Event Portal REST API and the SEMP v2 queue endpoints.
+
+It keeps every object in memory and serves the subset of
+``/api/v1/eventPortal/*`` and ``/SEMP/v2/config/msgVpns/*`` used by sep_tools,
+with pagination, name/id filters, configurable latency and rate limiting.
+
+    $ python benchmarks/fake_server.py --port 8900 --latency 0.05
+    $ sep --base-url http://localhost:8900 importOpenAPI ...
+
+GET responses carry an ETag and conditional GETs are answered with 304.
+``GET /__stats`` returns the request counters, ``POST /__reset`` drops all
+objects and counters.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+EP_PREFIX = "/api/v1/eventPortal/"
+SEMP_PREFIX = "/SEMP/v2/config/msgVpns/"
+EP_COLLECTIONS = ("applicationDomains", "applications", "schemas", "events")
+
+
+class RateLimiter:
+    """Token bucket, answers 429 once the bucket is empty"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class FakeState:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.ep = {coll: {} for coll in EP_COLLECTIONS}
+            self.queues = {}
+            self.requests = Counter()
+            self.throttled = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "total": sum(self.requests.values()),
+                "throttled": self.throttled,
+                "requests": dict(self.requests),
+                "objects": {coll: len(objs) for coll, objs in self.ep.items()},
+                "subscriptions": sum(len(q["subscriptions"]) for q in self.queues.values()),
+            }
+
+    # ---------------------------- Event Portal ----------------------------
+
+    def ep_new(self, coll, data):
+        obj = dict(data)
+        obj["id"] = uuid.uuid4().hex[:12]
+        if coll == "events":
+            obj.setdefault("schemaId", None)
+            obj.setdefault("description", "")
+            obj["producedApplicationIds"] = []
+            obj["consumedApplicationIds"] = []
+        elif coll == "applications":
+            obj["producedEventIds"] = []
+            obj["consumedEventIds"] = []
+        elif coll == "applicationDomains":
+            obj.setdefault("description", "")
+        self.ep[coll][obj["id"]] = obj
+        return obj
+
+    def ep_patch(self, coll, obj, data):
+        obj.update(data)
+        if coll == "applications":
+            # keep the back references of events in line
+            for key, back in (("producedEventIds", "producedApplicationIds"),
+                              ("consumedEventIds", "consumedApplicationIds")):
+                for e in self.ep["events"].values():
+                    ids = e[back]
+                    if e["id"] in obj[key] and obj["id"] not in ids:
+                        ids.append(obj["id"])
+                    elif e["id"] not in obj[key] and obj["id"] in ids:
+                        ids.remove(obj["id"])
+        return obj
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeEventPortal/1.0"
+    # headers and body are written separately, without TCP_NODELAY every
+    # response would wait for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    # --------------------------- plumbing ---------------------------
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    def _send(self, code, body=None, headers=None):
+        raw = json.dumps(body).encode() if body is not None else b""
+        if self.command == "GET" and code == 200:
+            # validator of the conditional GETs of the sep HTTP cache
+            etag = '"{}"'.format(hashlib.sha1(raw).hexdigest())
+            headers = dict(headers or {}, ETag=etag)
+            if self.headers.get("If-None-Match") == etag:
+                code, raw = 304, b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else {}
+
+    def _handle(self, verb):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self._body() if verb in ("post", "put", "patch") else {}
+        state = self.server.state
+
+        if url.path == "/__stats":
+            return self._send(200, state.stats())
+        if url.path == "/__reset":
+            state.reset()
+            return self._send(200, {})
+
+        if not self.server.limiter.allow():
+            with state.lock:
+                state.throttled += 1
+            return self._send(429, {"message": "Too Many Requests"}, {"Retry-After": "0.1"})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path.startswith(EP_PREFIX):
+            parts = url.path[len(EP_PREFIX):].strip("/").split("/")
+            with state.lock:
+                state.requests["{} {}".format(verb.upper(), parts[0])] += 1
+                return self._event_portal(verb, parts, query, body)
+        if url.path.startswith(SEMP_PREFIX):
+            parts = [unquote(p) for p in url.path[len(SEMP_PREFIX):].strip("/").split("/")]
+            with state.lock:
+                state.requests["{} semp/{}".format(verb.upper(), "/".join(parts[1::2]))] += 1
+                return self._semp(verb, parts, query, body)
+        return self._send(404, {"message": "Not Found"})
+
+    def do_GET(self): self._handle("get")
+    def do_POST(self): self._handle("post")
+    def do_PATCH(self): self._handle("patch")
+    def do_PUT(self): self._handle("put")
+    def do_DELETE(self): self._handle("delete")
+
+    # --------------------------- Event Portal ---------------------------
+
+    def _event_portal(self, verb, parts, query, body):
+        state = self.server.state
+        coll = parts[0]
+        if coll not in EP_COLLECTIONS:
+            return self._send(404, {"message": "Unknown collection"})
+        objs = state.ep[coll]
+
+        if len(parts) == 1:
+            if verb == "get":
+                return self._send(200, self._page(list(objs.values()), query))
+            if verb == "post":
+                if any(o["name"] == body.get("name") for o in objs.values()):
+                    return self._send(400, {"message": "name '{}' already exists".format(body.get("name"))})
+                return self._send(201, {"data": state.ep_new(coll, body)})
+            return self._send(405, {})
+
+        obj = objs.get(parts[1])
+        if not obj:
+            return self._send(404, {"message": "Not Found"})
+        if len(parts) == 3 and parts[2] == "generateAsyncApiRequest" and verb == "post":
+            return self._send(200, self._asyncapi(obj, body))
+        if verb == "get":
+            return self._send(200, {"data": obj})
+        if verb == "patch":
+            return self._send(200, {"data": state.ep_patch(coll, obj, body)})
+        if verb == "delete":
+            del objs[parts[1]]
+            return self._send(204)
+        return self._send(405, {})
+
+    def _page(self, items, query):
+        if "name" in query:
+            items = [o for o in items if o.get("name") == query["name"]]
+        if "applicationDomainId" in query:
+            items = [o for o in items if o.get("applicationDomainId") == query["applicationDomainId"]]
+        if "ids" in query:
+            ids = set(query["ids"].split(","))
+            items = [o for o in items if o["id"] in ids]
+        page_size = int(query.get("pageSize", 20))
+        page_number = int(query.get("pageNumber", 1))
+        total_pages = max(1, -(-len(items) // page_size))
+        start = (page_number - 1) * page_size
+        return {
+            "data": items[start:start + page_size],
+            "meta": {
+                "pagination": {
+                    "pageNumber": page_number,
+                    "count": len(items),
+                    "pageSize": page_size,
+                    "nextPage": page_number + 1 if page_number < total_pages else None,
+                    "totalPages": total_pages,
+                }
+            }
+        }
+
+    def _asyncapi(self, app, body):
+        state = self.server.state
+        channels = {}
+        for key, op in (("producedEventIds", "subscribe"), ("consumedEventIds", "publish")):
+            for eid in app.get(key, []):
+                e = state.ep["events"].get(eid)
+                if not e: continue
+                message = {"name": e["name"], "description": e.get("description", "")}
+                schema = state.ep["schemas"].get(e.get("schemaId"))
+                if schema and schema.get("content"):
+                    message["payload"] = json.loads(schema["content"])
+                channels.setdefault(e["topicName"], {})[op] = {"message": message}
+        return {
+            "asyncapi": body.get("asyncApiVersion", "2.0.0"),
+            "info": {"title": app["name"], "version": "0.0.1"},
+            "channels": channels,
+        }
+
+    # ------------------------------ SEMP v2 ------------------------------
+
+    def _semp_error(self, code, status, description):
+        return self._send(code, {"meta": {"error": {
+            "code": 6 if status == "NOT_FOUND" else 10,
+            "status": status,
+            "description": description}, "responseCode": code}})
+
+    def _semp(self, verb, parts, query, body):
+        queues = self.server.state.queues
+        ok = lambda data: self._send(200, {"data": data, "meta": {"responseCode": 200}})
+        # parts: <vpn> queues [<queue> [subscriptions [<topic>]]]
+        if len(parts) < 2 or parts[1] != "queues":
+            return self._semp_error(400, "NOT_FOUND", "Unsupported resource")
+        if len(parts) == 2:
+            if verb == "post":
+                name = body.get("queueName")
+                if name in queues:
+                    return self._semp_error(400, "ALREADY_EXISTS", "Queue already exists")
+                queues[name] = {"data": dict(body, msgVpnName=parts[0]), "subscriptions": []}
+                return ok(queues[name]["data"])
+            return ok([q["data"] for q in queues.values()])
+
+        queue = queues.get(parts[2])
+        if queue is None:
+            return self._semp_error(400, "NOT_FOUND", "Could not find match for queue")
+        if len(parts) == 3:
+            if verb == "delete":
+                del queues[parts[2]]
+                return ok({})
+            return ok(queue["data"])
+
+        subs = queue["subscriptions"]
+        if len(parts) == 4:
+            if verb == "post":
+                topic = body.get("subscriptionTopic")
+                if topic in subs:
+                    return self._semp_error(400, "ALREADY_EXISTS", "Subscription already exists")
+                subs.append(topic)
+                return ok({"subscriptionTopic": topic, "queueName": parts[2]})
+            count = int(query.get("count", 10))
+            start = int(query.get("cursor", 0) or 0)
+            data = [{"subscriptionTopic": t, "queueName": parts[2]} for t in subs[start:start + count]]
+            meta = {"responseCode": 200}
+            if start + count < len(subs):
+                meta["paging"] = {
+                    "cursorQuery": str(start + count),
+                    "nextPageUri": "http://{}:{}{}{}/queues/{}/subscriptions?count={}&cursor={}".format(
+                        self.server.server_address[0], self.server.server_address[1], SEMP_PREFIX,
+                        quote(parts[0], safe=""), quote(parts[2], safe=""), count, start + count)}
+            return self._send(200, {"data": data, "meta": meta})
+
+        topic = parts[4]
+        if topic not in subs:
+            return self._semp_error(400, "NOT_FOUND", "Could not find match for subscription")
+        if verb == "delete":
+            subs.remove(topic)
+            return ok({})
+        return ok({"subscriptionTopic": topic, "queueName": parts[2]})
+
+
+def make_server(host="127.0.0.1", port=0, latency=0.0, rate=0.0):
+    """Create (but do not start) a fake server, port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.state = FakeState()
+    server.latency = latency
+    server.limiter = RateLimiter(rate)
+    return server
+
+
+def start_server(**kwargs):
+    """Start a fake server in a background thread and return it"""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0,
+        help="seconds of latency added to every request")
+    parser.add_argument("--rate", type=float, default=0.0,
+        help="max requests per second before answering 429, 0 for unlimited")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.latency, args.rate)
+    print("Fake Event Portal/SEMP listening on http://{}:{}".format(*server.server_address))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
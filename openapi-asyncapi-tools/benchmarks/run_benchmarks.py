@@ -0,0 +1,142 @@
+"""End-to-end benchmarks of the sep commands against the local fake server.
+
+Every OpenAPI 3.x spec of api-samples/ (or the given ones) is run through
+
+    importOpenAPI (cold)   nothing exists yet and the spec cache is empty
+    importOpenAPI (warm)   all objects exist and the spec cache is filled
+    createQueue
+    generateOpenAPI
+
+each as its own `python -m sep_tools.cmd` process, and the wall time, the
+number of requests the fake server received and the peak RSS of the process
+are reported.
+
+    $ python benchmarks/run_benchmarks.py --latency 0.02
+    $ python benchmarks/run_benchmarks.py --rate 50 --json results.json api-samples/stripe.json
+    $ python benchmarks/run_benchmarks.py --sep-args "--pool-size 20 --prefetch 8"
+"""
+import argparse
+import glob
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_server import start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def unsupported(spec):
+    """Why the commands would reject the spec, None for an OpenAPI 3.x spec"""
+    from sep_tools.loader import parse_spec
+    try:
+        with open(spec, "rb") as f:
+            doc = parse_spec(f.read())
+    except Exception as e:
+        return "could not be parsed: {}".format(str(e).splitlines()[0])
+    version = str(doc.get("openapi") or doc.get("swagger") or "unknown") if isinstance(doc, dict) else "unknown"
+    if not version.startswith("3."):
+        return "OpenAPI {}, not 3.x".format(version)
+    return None
+
+
+def run(name, args, env):
+    """Run one sep command, return (exit code, wall seconds, peak RSS in MB)"""
+    start = time.perf_counter()
+    p = subprocess.Popen([sys.executable, "-m", "sep_tools.cmd"] + args, cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = p.stderr.read()
+    # wait4 returns the resource usage of this very child, unlike RUSAGE_CHILDREN
+    _, status, usage = os.wait4(p.pid, 0)
+    elapsed = time.perf_counter() - start
+    p.returncode = os.waitstatus_to_exitcode(status)
+    p.stderr.close()
+    if p.returncode:
+        lines = stderr.decode(errors="replace").strip().splitlines()
+        print("  {} failed: {}".format(name, lines[-1] if lines else p.returncode),
+            file=sys.stderr)
+    # ru_maxrss is in KB on Linux
+    return p.returncode, elapsed, usage.ru_maxrss / 1024.0
+
+
+def bench_spec(server, spec, workdir, env, extra_args):
+    domain = os.path.splitext(os.path.basename(spec))[0]
+    cache_dir = os.path.join(workdir, domain + ".cache")
+    group = ["--cache-dir", cache_dir] + extra_args
+    steps = [
+        ("importOpenAPI (cold)", ["importOpenAPI", spec, "--domain", domain, "--application", domain]),
+        ("importOpenAPI (warm)", ["importOpenAPI", spec, "--domain", domain, "--application", domain]),
+        ("createQueue", ["createQueue", spec, "--queue", domain, "--host", env["SEP_BASE_URL"]]),
+        ("generateOpenAPI", ["generateOpenAPI", domain, "-o", os.path.join(workdir, domain + ".out.json")]),
+    ]
+    server.state.reset()
+    results = []
+    for name, args in steps:
+        before = server.state.stats()
+        code, elapsed, rss = run(name, group + args, env)
+        after = server.state.stats()
+        results.append({
+            "spec": os.path.basename(spec),
+            "command": name,
+            "ok": code == 0,
+            "seconds": round(elapsed, 3),
+            "requests": after["total"] - before["total"],
+            "throttled": after["throttled"] - before["throttled"],
+            "peak_rss_mb": round(rss, 1),
+        })
+    return results
+
+
+def print_table(results):
+    header = ("spec", "command", "ok", "seconds", "requests", "throttled", "peak_rss_mb")
+    rows = [header] + [tuple(str(r[k]) for k in header) for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print("  ".join(cell.ljust(w) for cell, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("specs", nargs="*",
+        help="specs to run, all files of api-samples/ by default")
+    parser.add_argument("--latency", type=float, default=0.0,
+        help="seconds of latency the fake server adds to every request")
+    parser.add_argument("--rate", type=float, default=0.0,
+        help="requests per second the fake server allows before answering 429")
+    parser.add_argument("--json", metavar="FILE",
+        help="also write the results to this file")
+    parser.add_argument("--sep-args", default="",
+        help='extra group options of sep, like "--pool-size 20 --prefetch 8"')
+    args = parser.parse_args()
+
+    specs = args.specs or sorted(glob.glob(os.path.join(ROOT, "api-samples", "*")))
+    extra_args = shlex.split(args.sep_args)
+    server = start_server(latency=args.latency, rate=args.rate)
+    base_url = "http://{}:{}".format(*server.server_address)
+    env = dict(os.environ, SEP_BASE_URL=base_url, EVENT_PORTAL_TOKEN="benchmark",
+        SOL_ADMIN_PWD="admin")
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for spec in specs:
+            reason = unsupported(spec)
+            if reason:
+                print("Skipping {}: {}".format(spec, reason), file=sys.stderr)
+                continue
+            print("Running {} ...".format(spec), file=sys.stderr)
+            results.extend(bench_spec(server, os.path.abspath(spec), workdir, env, extra_args))
+    server.shutdown()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Startup benchmark of the sep CLI.
+
+Measures the import time of sep_tools.cmd and the wall time of `sep --help`
+(as `python -m sep_tools.cmd --help`), each as the median of fresh
+processes, and checks that no heavy module is imported at startup.
+
+    $ python benchmarks/startup.py
+    $ python benchmarks/startup.py --runs 20 --max-import-ms 60 --json startup.json
+
+The exit code is 1 when a limit is exceeded, so that it can guard CI
+against startup regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules only the commands which need them may import
+HEAVY_MODULES = ("requests", "urllib3", "yaml", "orjson", "sep_tools.EventPortal",
+    "sep_tools.plan", "concurrent.futures.thread")
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import sep_tools.cmd
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_import(runs):
+    samples, heavy = [], set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout
+        result = json.loads(out)
+        samples.append(result["seconds"])
+        heavy.update(result["heavy"])
+    return statistics.median(samples), sorted(heavy)
+
+
+def measure_help(runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "sep_tools.cmd", "--help"], cwd=ROOT,
+            stdout=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10,
+        help="number of processes per measurement")
+    parser.add_argument("--max-import-ms", type=float, default=0,
+        help="fail above this median import time of sep_tools.cmd, 0 for no limit")
+    parser.add_argument("--max-help-ms", type=float, default=0,
+        help="fail above this median wall time of sep --help, 0 for no limit")
+    parser.add_argument("--json", metavar="FILE",
+        help="also write the results to this file")
+    args = parser.parse_args()
+
+    import_seconds, heavy = measure_import(args.runs)
+    help_seconds = measure_help(args.runs)
+    results = {
+        "import_ms": round(import_seconds*1000, 1),
+        "help_ms": round(help_seconds*1000, 1),
+        "heavy_modules": heavy,
+    }
+    print("import sep_tools.cmd  {:>8.1f} ms".format(results["import_ms"]))
+    print("sep --help            {:>8.1f} ms".format(results["help_ms"]))
+    print("heavy modules         {}".format(", ".join(heavy) or "none"))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = bool(heavy)
+    if args.max_import_ms and results["import_ms"] > args.max_import_ms:
+        print("import time above {} ms".format(args.max_import_ms), file=sys.stderr)
+        failed = True
+    if args.max_help_ms and results["help_ms"] > args.max_help_ms:
+        print("--help time above {} ms".format(args.max_help_ms), file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,20 @@
 import logging
+import itertools
 import json
-import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from urllib.parse import quote
 
-import yaml
 from .util import *
+from .loader import SpecLoader
+from .manifest import content_hash
+from .metrics import phase
+from .output import SpecWriter
+from .plan import DEFAULT_APPLICATION, plan_spec
+from .records import UNKNOWN, Application, ApplicationDomain, Event, Schema
+from .topics import minimize_subscriptions
 
 class EventPortal:
-    spec = {}
-    ApplicationDomains = {}
-    Applications = {}
-    Schemas = {}
-    Events = {}
-    
-    _refSchemaRe = re.compile(r'\#\/components\/schemas/([^\/]+)$')
     _base_url = "https://solace.cloud"
 
 
@@ -21,7 +23,24 @@ class EventPortal:
         admin_password="default", 
         host="", 
         vpn="default",
-        queueName = "api_queue"):
+        queueName = "api_queue",
+        client=None,
+        concurrency=8,
+        bulk_threshold=50,
+        max_ref_nodes=2000,
+        loader=None,
+        reconcile=False,
+        prune=False,
+        max_extra_topics=None,
+        multi_level=False,
+        page_size=100,
+        prefetch=4,
+        ids_chunk_size=50,
+        base_url=None,
+        index=None,
+        journal=None,
+        dedupe_schemas=False,
+        http_cache=None):
 
         super().__init__()
         self.token = token
@@ -31,197 +50,511 @@ class EventPortal:
         self.host = host
         self.vpn = vpn
         self.queueName = queueName
-
-    def importOpenAPISpec(self, spec_path, domain, application):
+        # max number of requests in flight for the bulk phases
+        self.concurrency = max(1, concurrency)
+        # share one pooled session for all calls of this run, large enough
+        # for the bulk phases and the pages prefetched meanwhile
+        self.client = client or get_client(self.concurrency + prefetch)
+        # above this number of schemas and events, existence is checked
+        # against a full inventory instead of one lookup per name
+        self.bulk_threshold = bulk_threshold
+        # nested references expanding to more nodes are not inlined
+        self.max_ref_nodes = max_ref_nodes
+        self.loader = loader or SpecLoader()
+        # update existing schemas and events whose content drifted from the spec
+        self.reconcile = reconcile
+        # delete the events of the application which are not in the spec
+        # and the schemas only they use
+        self.prune = prune
+        # when set, queue subscriptions are collapsed into wildcards that
+        # match at most that many extra known topics per merge
+        self.max_extra_topics = max_extra_topics
+        # whether they may also be collapsed into prefix/> wildcards
+        self.multi_level = multi_level
+        # paging of collection listings, up to prefetch pages are
+        # fetched ahead once the number of pages is known
+        self.page_size = page_size
+        self.prefetch = prefetch
+        # max number of ids per "ids=" query
+        self.ids_chunk_size = ids_chunk_size
+        # e.g. a local stand-in of Event Portal
+        if base_url: self._base_url = base_url.rstrip("/")
+        # name index of the schemas and events shared with other imports
+        # into the same domain, see batch.ExistenceIndex
+        self.index = index
+        # checkpoint journal of every object whose id is known
+        self.journal = journal
+        # share one schema between all events with identical bodies
+        self.dedupe_schemas = dedupe_schemas
+        # on-disk cache of GET responses, only for read-only commands
+        self.http_cache = http_cache
+
+        # the Records of the import by name, per instance so that
+        # several imports can run in one process
+        self.ApplicationDomains = {}
+        self.Applications = {}
+        self.Schemas = {}
+        self.Events = {}
+
+    def importOpenAPISpec(self, spec_path, domain=None, application=None, manifest=None,
+        default_application=DEFAULT_APPLICATION):
+        """Import a spec or a plan, see plan.plan_spec for the domain,
+        application and pubFlag of None"""
         self.spec_path = spec_path
+        plan = plan_spec(self.loader, spec_path, domain, application, self.pubFlag,
+            self.max_ref_nodes, self.dedupe_schemas, default_application)
+        logging.info("Import file '{}' to build Application '{}' within Domain '{}'".format(
+            spec_path, plan["application"]["name"], plan["domain"]["name"]))
+        self.apply_plan(plan, manifest)
+
+    def apply_plan(self, plan, manifest=None):
+        """Create or update everything the plan holds in Event Portal"""
+        domain = plan["domain"]["name"]
+        application = plan["application"]["name"]
         self.domainName = domain
         self.appName = application
-        self.ApplicationDomains[domain]={
-            "payload":{
-                "name": domain,
-                "enforceUniqueTopicNames": True,
-                "topicDomain": "",
-            }
-        }
-        self.Applications[application]={
-            "payload":{
-                "name": application,
-            }
-        }
-        
-        with open(spec_path) as f:
-            text_context = f.read()
-            self.spec = yaml.safe_load(text_context)
-
-        version = self.spec.get("openapi")
-        if not version:
-            logging.error("There is no 'openapi' filed in {}".format(spec_path))
-            raise SystemExit
-
-        if int(version.split(".")[0]) < 3:
-            logging.error("The open api version of '{}' is {}, must be 3.x.".format(spec_path, version))
-            raise SystemExit
-
-        self.generate_ep_objects()
-        self.check_existed_objects()
-        self.create_all_objects()
-        
-
-    def generate_ep_objects(self):
-        for path, path_item in self.spec["paths"].items():
-            for method in HTTP_METHODS:
-                if method not in path_item: continue
-                operation = path_item.get(method)
-                operationId = operation.get("operationId")
-                event = {
-                    "schemaName": None,
-                    "payload": {
-                        "name": operationId,
-                        "description": operation.get("description", ""),
-                        "topicName": method.upper()+path,
-                    }
-                }
-
-                schemaName = self._extract_schema_from_operation(operation)
-                if schemaName : event["schemaName"]=schemaName
-                self.Events[operationId]=event
-        
-    def _extract_schema_from_operation(self, operation):
-        schemaName = None
-        content = operation.get("requestBody", {'content':{}}).get("content")
-        jsonkeys = [k for k in content.keys() if k.startswith("application/json")]
-        if len(jsonkeys) > 0:
-            # only extract the first matched json schema
-            schema = content.get(jsonkeys[0]).get("schema")
-            if schema.get("$ref"):
-                # Reference Object like #/components/schemas/CouponRequest
-                schemaName = self._refSchemaRe.search(schema.get("$ref")).group(1)
-                if not self.Schemas.get(schemaName): 
-                    self.Schemas[schemaName]={
-                        "id": None,
-                        "payload": {
-                            "contentType": "JSON",
-                            "content": json.dumps(self._get_component_schema(schemaName)),
-                            "name": schemaName,
-                        }
-                    }
-            else:
-                # Inline Schema Object
-                schemaName = operation.get("operationId")+"_schema"
-                self.Schemas[schemaName]={
-                    "id": None,
-                    "payload": {
-                        "contentType": "JSON",
-                        "content": json.dumps(schema),
-                        "name": schemaName,
-                    }
-                }
-        return schemaName
-
-    def _get_component_schema(self, schemaName):
-        payload = self.spec["components"]["schemas"][schemaName]
-        self._dfs_ref_dict(payload)
-
-        return payload
-
-    def _dfs_ref_dict(self, payload):
-        # Go through all reference object to combine an integrated schema
-        # since Event Portal doesn't support reference insice schema
-        for key, value in payload.items():
-            if type(value) is dict:
-                if value.get("$ref"):
-                    # Reference Object
-                    schemaName = self._refSchemaRe.search(value.get("$ref")).group(1)
-                    payload[key] = self._get_component_schema(schemaName)
-                else:
-                    self._dfs_ref_dict(value)
-
+        self.pubFlag = plan["application"]["pub"]
+        self.ApplicationDomains = {domain: ApplicationDomain.from_plan(domain, plan["domain"])}
+        self.Applications = {application: Application.from_plan(application, plan["application"])}
+        self.Schemas = {k: Schema.from_plan(k, v) for k, v in plan["schemas"].items()}
+        self.Events = {k: Event.from_plan(k, v) for k, v in plan["events"].items()}
+
+        # objects of the previous sync that are gone from the spec
+        self.Removed = {"schemas": {}, "events": {}}
+        # event ids the application is already linked to
+        self.linkedEventIds = None
+        # (coll, name) of the objects taken over from the journal, they
+        # aren't reconciled again
+        self.resumed = set()
+
+        if manifest and manifest.matches(domain, application):
+            self._apply_manifest(manifest)
+        elif manifest and manifest.data:
+            logging.info("Manifest '{}' doesn't match, doing a full sync".format(manifest))
+        if self.journal:
+            self._apply_journal(self.journal.start(domain, application))
+        try:
+            with phase("check"):
+                self.check_existed_objects()
+            self.create_all_objects()
+        finally:
+            # kept on failure for a --resume
+            if self.journal: self.journal.close()
+        if manifest:
+            manifest.save(
+                {"name": domain, "id": self.ApplicationDomains[domain].id},
+                {"name": application, "id": self.Applications[application].id},
+                self.pubFlag, self.Schemas, self.Events)
+        if self.journal:
+            self.journal.finish()
+
+    def _apply_manifest(self, manifest):
+        # reuse the ids of the last sync, then only new objects have to be
+        # checked, changed ones updated and removed ones deleted
+        self.ApplicationDomains[self.domainName].id = manifest.get("domain")["id"]
+        self.Applications[self.appName].id = manifest.get("application")["id"]
+        for coll_name, coll_objs in (("schemas", self.Schemas), ("events", self.Events)):
+            known = manifest.get(coll_name)
+            for obj_name, obj in coll_objs.items():
+                if obj_name not in known: continue
+                obj.id = known[obj_name]["id"]
+                obj.changed = obj.hash != known[obj_name]["hash"]
+            self.Removed[coll_name] = {obj_name: v["id"] for obj_name, v in known.items() \
+                if obj_name not in coll_objs}
+
+        application = manifest.get("application")
+        if application["pub"] == self.pubFlag:
+            self.linkedEventIds = application["eventIds"]
+
+        logging.info("Manifest '{}': {} new, {} changed, {} removed objects".format(
+            manifest,
+            sum(1 for c in (self.Schemas, self.Events) for v in c.values() if not v.id),
+            sum(1 for c in (self.Schemas, self.Events) for v in c.values() if v.changed),
+            sum(len(v) for v in self.Removed.values())))
+
+    def _apply_journal(self, entries):
+        # take over what the failed run already did, these objects are
+        # neither looked up nor created again
+        resumed = 0
+        for coll_name, coll_objs in (("applicationDomains", self.ApplicationDomains),
+            ("applications", self.Applications), ("schemas", self.Schemas), ("events", self.Events)):
+            for obj_name, entry in entries.get(coll_name, {}).items():
+                if entry["op"] == "delete":
+                    self.Removed.get(coll_name, {}).pop(obj_name, None)
+                    continue
+                obj = coll_objs.get(obj_name)
+                if obj is None: continue
+                obj.id = entry["id"]
+                if entry.get("hash"):
+                    # created, updated or reconciled from the same content
+                    obj.changed = entry["hash"] != obj.hash
+                    self.resumed.add((coll_name, obj_name))
+                if "schemaId" in entry:
+                    obj.remoteSchemaId = entry["schemaId"]
+                if entry["op"] == "link" and entry["pub"] == self.pubFlag:
+                    self.linkedEventIds = entry["eventIds"]
+                resumed += 1
+        if resumed:
+            logging.info("{} objects resumed from the journal".format(resumed))
 
     def check_existed_objects(self):
+        logging.info("Checking existed objects ...")
+        # the application domain goes first, since every other object
+        # is verified to belong to it
+        applicationDomainId = None
+        for obj_name, obj in self.ApplicationDomains.items():
+            if obj.id:
+                applicationDomainId = obj.id
+                continue
+            print(".", end="", flush=True)
+            data = self._getObjectByName("applicationDomains", obj_name)
+            if data:
+                obj.id = data["id"]
+                applicationDomainId = obj.id
+                self._checkpoint("found", "applicationDomains", obj_name, obj)
+                logging.warn("ApplicationDomain '{}' already exists".format(obj_name))
+
+        self._check_colls(applicationDomainId)
+        if self.prune and applicationDomainId:
+            self._find_orphans(applicationDomainId, self.Applications[self.appName].id)
+
+    def _check_colls(self, applicationDomainId):
+        # objects known from the manifest don't need to be checked, unless
+        # they are reconciled against their current content
         to_check = {
-            "applicationDomains": self.ApplicationDomains,
-            "applications": self.Applications,
-            "schemas": self.Schemas,
-            "events": self.Events,
+            coll_name: {k: v for k, v in coll_objs.items() \
+                if not v.id or (self.reconcile and coll_name != "applications" and \
+                    (coll_name, k) not in self.resumed)}
+            for coll_name, coll_objs in (("applications", self.Applications),
+                ("schemas", self.Schemas), ("events", self.Events))
         }
-
-        logging.info("Checking existed objects ...")
+        # page through the whole schemas and events collections once and
+        # match names locally when there are too many objects to look up
+        # one by one, the inventory also covers other application domains
+        # so that conflicts are still detected
+        if not any(to_check.values()): return
+        use_bulk = self.index is not None or \
+            len(to_check["schemas"])+len(to_check["events"]) > self.bulk_threshold
         isError = False
-        applicationDomainId = None
-        for coll_name, coll_objs in to_check.items():
-            coll_url = self._base_url+"/api/v1/eventPortal/"+coll_name
-            for obj_name, obj in coll_objs.items():
-                print(".", end="", flush=True)
-                url = coll_url+"?name="+obj_name
-                rJson = rest("get", url, token=self.token)
-                if len(rJson["data"]) > 0:
-                    obj["id"] = rJson["data"][0]["id"]
-                    obj["applicationDomainId"] = rJson["data"][0].get("applicationDomainId")
-                    if coll_name == "applicationDomains":
-                        applicationDomainId = obj["id"]
-                    elif obj["applicationDomainId"] != applicationDomainId:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                lookups = []
+                for coll_name, coll_objs in to_check.items():
+                    index = None
+                    if use_bulk and coll_name != "applications" and coll_objs:
+                        # the inventory covers the whole account, it is only
+                        # paged through while that costs fewer requests than
+                        # looking up every name
+                        fetch = lambda: self._indexAllObjects(coll_name, {}, max_pages=len(coll_objs))
+                        index = self.index.get(coll_name, fetch) if self.index is not None else fetch()
+                    if index is not None:
+                        lookups.extend((coll_name, obj_name, obj, index.get(obj_name))
+                            for obj_name, obj in coll_objs.items())
+                    else:
+                        lookups.extend((coll_name, obj_name, obj,
+                            executor.submit(self._getObjectByName, coll_name, obj_name))
+                            for obj_name, obj in coll_objs.items())
+                for coll_name, obj_name, obj, data in lookups:
+                    if isinstance(data, Future):
+                        data = data.result()
+                        print(".", end="", flush=True)
+                    if not data:
+                        # e.g. deleted since the manifest was written
+                        obj.id = None
+                        obj.changed = False
+                        continue
+                    obj.id = data["id"]
+                    if data.get("applicationDomainId") != applicationDomainId:
                         logging.error("{} '{}' already exists with another Application Domain[id:{}]".\
-                            format(coll_name[:-1].capitalize(), obj_name, obj["applicationDomainId"]))
+                            format(coll_name[:-1].capitalize(), obj_name, data.get("applicationDomainId")))
                         isError = True
+                    elif self.reconcile and coll_name != "applications":
+                        self._reconcile_object(coll_name, obj_name, obj, data)
                     else:
                         logging.warn("{} '{}' already exists".format(coll_name[:-1].capitalize(), obj_name))
+                        self._checkpoint("found", coll_name, obj_name, obj)
+            except BaseException:
+                # e.g. a RestError, the lookups which didn't start yet are dropped
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
 
         print()
         if isError: 
-            raise SystemExit
-
+            raise SystemExit(1)
+
+
+    def _reconcile_object(self, coll_name, obj_name, obj, data):
+        # compare the server side content with the one of the spec
+        if coll_name == "schemas":
+            try:
+                remote = json.loads(data.get("content") or "null")
+            except ValueError:
+                remote = data.get("content")
+            obj.changed = \
+                content_hash({"contentType": data.get("contentType"), "content": remote}) != \
+                content_hash({"contentType": obj.contentType, "content": json.loads(obj.content)})
+        else:
+            obj.changed = any(data.get(k, "") != getattr(obj, k) for k in ("description", "topicName"))
+            # the schema id is only known once all schemas are created
+            obj.remoteSchemaId = data.get("schemaId")
+        if obj.changed:
+            logging.info("{} '{}' differs from the spec".format(coll_name[:-1].capitalize(), obj_name))
+        else:
+            # a --resume doesn't need to compare it again
+            self._checkpoint("found", coll_name, obj_name, obj, same_content=True)
+
+    def _find_orphans(self, applicationDomainId, applicationId):
+        # the events of the application which are not in the spec, and
+        # their schemas once no other event uses them. The domain is shared
+        # with other applications, whose objects are left alone.
+        if not applicationId: return
+        orphans, kept = {}, []
+        for event in self._iterAllObjects("events", {"applicationDomainId": applicationDomainId}):
+            appIds = set(event.get("consumedApplicationIds") or []) | \
+                set(event.get("producedApplicationIds") or [])
+            if event["name"] in self.Events or applicationId not in appIds:
+                kept.append(event)
+            elif appIds != {applicationId}:
+                logging.warning("Event '{}' is not in the spec but used by other applications, "
+                    "not pruned".format(event["name"]))
+                kept.append(event)
+            else:
+                orphans[event["name"]] = event
+        self.Removed["events"].update((k, v["id"]) for k, v in orphans.items())
+
+        schemaIds = set(e["schemaId"] for e in orphans.values() if e.get("schemaId")) - \
+            set(e.get("schemaId") for e in kept)
+        if schemaIds:
+            for schema in self._iterAllObjects("schemas", {"applicationDomainId": applicationDomainId}):
+                if schema["id"] in schemaIds and schema["name"] not in self.Schemas:
+                    self.Removed["schemas"][schema["name"]] = schema["id"]
+        logging.info("{} schemas and {} events to prune".format(
+            len(self.Removed["schemas"]), len(self.Removed["events"])))
 
     def create_all_objects(self):
-        # 1. create application domain
-        self._create_colls("applicationDomains", self.ApplicationDomains)
-        applicationDomainId = self.ApplicationDomains[self.domainName]["id"]
-
-        # 2. create application
-        self.Applications[self.appName]["payload"]["applicationDomainId"] = applicationDomainId            
-        self._create_colls("applications", self.Applications)
-        applicationId = self.Applications[self.appName]["id"]
-
-        # 3. create all schemas
-        for s, v in self.Schemas.items():
-            if not v.get("id"):
-                v["payload"]["applicationDomainId"] = applicationDomainId
-        self._create_colls("schemas", self.Schemas)
-
-        # 4. create all events
-        for e, v in self.Events.items():
-            if not v.get("id"):
-                event = v["payload"]
-                event["applicationDomainId"] = applicationDomainId
-#                event["consumedApplicationIds"] = [applicationId]
-                if v["schemaName"] in self.Schemas:
-                    event["schemaId"] = self.Schemas[v["schemaName"]]["id"]
-
-        self._create_colls("events", self.Events)
-
-        # 5. update the application to consume or publish all events
-        eventIds = [ v["id"] for e, v in self.Events.items() ]
-        data_json = { "producedEventIds" if self.pubFlag else "consumedEventIds": eventIds}
-        
-        url = self._base_url+"/api/v1/eventPortal/applications/"+applicationId
-        rJson = rest("patch", url, data_json=data_json, token=self.token)
-        logging.info("Events {} setting of Application '{}' on all events successfully.".\
-            format('Published' if self.pubFlag else 'Subscribed', self.appName))
-
+        with phase("create"):
+            # 1. create application domain
+            self._create_colls("applicationDomains", self.ApplicationDomains)
+            applicationDomainId = self.ApplicationDomains[self.domainName].id
+
+            # 2. create application
+            self.Applications[self.appName].applicationDomainId = applicationDomainId
+            self._create_colls("applications", self.Applications)
+            applicationId = self.Applications[self.appName].id
+
+            # 3. create all schemas and events in parallel, every event as soon
+            #    as the id of its schema is known
+            failures = self._create_schemas_and_events(applicationDomainId)
+            self._raise_on_failures("create", failures)
+
+            # 4. update the objects that changed since the last sync
+            self._raise_on_failures("update", self._update_changed_objects(applicationDomainId))
+
+        with phase("link"):
+            # 5. update the application to consume or publish all events
+            eventIds = [ v.id for e, v in self.Events.items() ]
+            if self.linkedEventIds is None or sorted(eventIds) != self.linkedEventIds:
+                data_json = { "producedEventIds" if self.pubFlag else "consumedEventIds": eventIds}
+
+                url = self._base_url+"/api/v1/eventPortal/applications/"+applicationId
+                rJson = rest("patch", url, data_json=data_json, token=self.token, client=self.client)
+                if self.journal:
+                    self.journal.record("link", "applications", self.appName, applicationId,
+                        pub=self.pubFlag, eventIds=sorted(eventIds))
+                logging.info("Events {} setting of Application '{}' on all events successfully.".\
+                    format('Published' if self.pubFlag else 'Subscribed', self.appName))
+
+        with phase("delete"):
+            # 6. delete the objects that are gone from the spec, events first
+            #    since they refer to the schemas, unless something else uses them
+            self._spare_shared(applicationDomainId, applicationId)
+            for coll_name in ("events", "schemas"):
+                self._raise_on_failures("delete", self._run_all([
+                    (coll_name, obj_name, self._delete_object, (coll_name, obj_name, obj_id))
+                    for obj_name, obj_id in self.Removed[coll_name].items()]))
+
+
+    def _spare_shared(self, applicationDomainId, applicationId):
+        # the objects gone from the spec are only unlinked from the application
+        # while other applications use them, like in _find_orphans. Their
+        # back references are up to date once the application is linked.
+        if not any(self.Removed.values()): return
+        events = {e["id"]: e for e in self._iterAllObjects("events",
+            {"applicationDomainId": applicationDomainId})}
+        for obj_name, obj_id in list(self.Removed["events"].items()):
+            event = events.get(obj_id)
+            if event is None:
+                # e.g. deleted by hand since the last sync
+                del self.Removed["events"][obj_name]
+                continue
+            appIds = set(event.get("consumedApplicationIds") or []) | \
+                set(event.get("producedApplicationIds") or [])
+            if appIds - {applicationId}:
+                logging.warning("Event '{}' is not in the spec but used by other applications, "
+                    "only unlinked".format(obj_name))
+                del self.Removed["events"][obj_name]
+        deleted = set(self.Removed["events"].values())
+        schemaIds = set(e.get("schemaId") for e in events.values() if e["id"] not in deleted)
+        for obj_name, obj_id in list(self.Removed["schemas"].items()):
+            if obj_id in schemaIds:
+                logging.warning("Schema '{}' is not in the spec but used by other events, "
+                    "not deleted".format(obj_name))
+                del self.Removed["schemas"][obj_name]
+
+    def _raise_on_failures(self, action, failures):
+        if not failures: return
+        for coll_name, obj_name, reason in failures:
+            logging.error("Failed to {} {} '{}': {}".format(
+                action, coll_name[:-1].capitalize(), obj_name, reason))
+        logging.error("{} objects could not be {}d".format(len(failures), action))
+        raise SystemExit(1)
+
+    def _run_all(self, jobs):
+        # run independent (coll_name, obj_name, fn, args) jobs concurrently
+        # and return the failures
+        failures = []
+        if not jobs: return failures
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [(coll_name, obj_name, executor.submit(fn, *args))
+                for coll_name, obj_name, fn, args in jobs]
+            for coll_name, obj_name, future in futures:
+                error = future.exception()
+                if error:
+                    failures.append((coll_name, obj_name, str(error) or repr(error)))
+        return failures
+
+    def _update_changed_objects(self, applicationDomainId):
+        jobs = []
+        for coll_name, coll_objs in (("schemas", self.Schemas), ("events", self.Events)):
+            for obj_name, obj_value in coll_objs.items():
+                if coll_name == "events" and obj_value.remoteSchemaId is not UNKNOWN:
+                    schema = self.Schemas.get(obj_value.schemaName)
+                    if obj_value.remoteSchemaId != (schema.id if schema else None):
+                        obj_value.changed = True
+                if not obj_value.changed: continue
+                obj_value.applicationDomainId = applicationDomainId
+                if coll_name == "events":
+                    schema = self.Schemas.get(obj_value.schemaName)
+                    obj_value.schemaId = schema.id if schema else None
+                jobs.append((coll_name, obj_name, self._update_object,
+                    (coll_name, obj_name, obj_value)))
+        return self._run_all(jobs)
+
+    def _create_schemas_and_events(self, applicationDomainId):
+        # Schemas don't depend on each other and an event only depends on
+        # its own schema, so run them as a DAG on a bounded thread pool.
+        # Failures are collected instead of stopping at the first one.
+        failures = []
+        running = {}
+        waiting = {}    # schema name -> events waiting for its id
+
+        def submit_event(obj_name, obj_value):
+            obj_value.applicationDomainId = applicationDomainId
+            if obj_value.schemaName in self.Schemas:
+                obj_value.schemaId = self.Schemas[obj_value.schemaName].id
+            running[executor.submit(self._create_object, "events", obj_name, obj_value)] = \
+                ("events", obj_name)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for obj_name, obj_value in self.Schemas.items():
+                if obj_value.id: continue
+                obj_value.applicationDomainId = applicationDomainId
+                running[executor.submit(self._create_object, "schemas", obj_name, obj_value)] = \
+                    ("schemas", obj_name)
+
+            for obj_name, obj_value in self.Events.items():
+                if obj_value.id: continue
+                schema = self.Schemas.get(obj_value.schemaName)
+                if schema and not schema.id:
+                    waiting.setdefault(obj_value.schemaName, []).append(obj_name)
+                else:
+                    submit_event(obj_name, obj_value)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    coll_name, obj_name = running.pop(future)
+                    error = future.exception()
+                    if error:
+                        failures.append((coll_name, obj_name, str(error) or repr(error)))
+                    if coll_name != "schemas": continue
+                    for event_name in waiting.pop(obj_name, []):
+                        if error:
+                            failures.append(("events", event_name,
+                                "its schema '{}' was not created".format(obj_name)))
+                        else:
+                            submit_event(event_name, self.Events[event_name])
+
+        return failures
 
     def _create_colls(self, coll_name, coll_objs):
         # create objects of the same type
-        coll_url = self._base_url+"/api/v1/eventPortal/"+coll_name
         for obj_name, obj_value in coll_objs.items():
-            if obj_value.get("id"):
+            if obj_value.id:
                 # means this object has been existed
                 continue
-            # expected_code=201 Created.
-            # The newly saved object is returned in the response body.
-            rJson = rest("post", coll_url, data_json=obj_value["payload"],\
-                expected_code=201, token=self.token)
-            obj_value["id"] = rJson["data"]["id"]
-            logging.info("{} '{}'[{}] created successfully".\
-                format(coll_name[:-1].capitalize(), obj_name, obj_value["id"]))
+            self._create_object(coll_name, obj_name, obj_value)
+
+    def _create_object(self, coll_name, obj_name, obj_value):
+        if self.index is None:
+            return self._post_object(coll_name, obj_name, obj_value)
+        # another spec of the domain may be creating the same object
+        with self.index.lock(coll_name, obj_name):
+            data = self.index.find(coll_name, obj_name)
+            if not data:
+                return self._post_object(coll_name, obj_name, obj_value)
+        if coll_name != "applicationDomains" and \
+            data.get("applicationDomainId") != obj_value.applicationDomainId:
+            raise RuntimeError("{} '{}' already exists with another Application Domain[id:{}]".\
+                format(coll_name[:-1].capitalize(), obj_name, data.get("applicationDomainId")))
+        obj_value.id = data["id"]
+        logging.info("{} '{}'[{}] was created by another spec".\
+            format(coll_name[:-1].capitalize(), obj_name, obj_value.id))
+        if self.reconcile and coll_name in ("schemas", "events"):
+            # updated along with the changed objects
+            self._reconcile_object(coll_name, obj_name, obj_value, data)
+        else:
+            self._checkpoint("found", coll_name, obj_name, obj_value)
+
+    def _post_object(self, coll_name, obj_name, obj_value):
+        coll_url = self._base_url+"/api/v1/eventPortal/"+coll_name
+        # expected_code=201 Created.
+        # The newly saved object is returned in the response body.
+        rJson = rest("post", coll_url, data_json=obj_value.payload(),\
+            expected_code=201, token=self.token, client=self.client)
+        obj_value.id = rJson["data"]["id"]
+        if self.index is not None: self.index.put(coll_name, rJson["data"])
+        self._checkpoint("create", coll_name, obj_name, obj_value)
+        logging.info("{} '{}'[{}] created successfully".\
+            format(coll_name[:-1].capitalize(), obj_name, obj_value.id))
+
+    def _update_object(self, coll_name, obj_name, obj_value):
+        obj_url = self._base_url+"/api/v1/eventPortal/"+coll_name+"/"+obj_value.id
+        rJson = rest("patch", obj_url, data_json=obj_value.payload(update=True),
+            token=self.token, client=self.client)
+        if self.index is not None: self.index.put(coll_name, rJson["data"])
+        self._checkpoint("update", coll_name, obj_name, obj_value)
+        logging.info("{} '{}'[{}] updated successfully".\
+            format(coll_name[:-1].capitalize(), obj_name, obj_value.id))
+
+    def _checkpoint(self, op, coll_name, obj_name, obj_value, same_content=False):
+        # the hash tells that the object holds the content of the spec,
+        # found objects only do once reconciled
+        if not self.journal: return
+        extra = {}
+        if (op != "found" or same_content) and obj_value.hash:
+            extra["hash"] = obj_value.hash
+        if same_content and coll_name == "events":
+            extra["schemaId"] = obj_value.remoteSchemaId
+        self.journal.record(op, coll_name, obj_name, obj_value.id, **extra)
+
+    def _delete_object(self, coll_name, obj_name, obj_id):
+        obj_url = self._base_url+"/api/v1/eventPortal/"+coll_name+"/"+obj_id
+        rest("delete", obj_url, expected_code=204, token=self.token, client=self.client)
+        if self.index is not None: self.index.discard(coll_name, obj_name)
+        if self.journal: self.journal.record("delete", coll_name, obj_name, obj_id)
+        logging.info("{} '{}'[{}] deleted successfully".\
+            format(coll_name[:-1].capitalize(), obj_name, obj_id))
 
 # --------------------------- generate Queue ---------------------------
     def createQueue(self, spec_path):
@@ -229,25 +562,24 @@ class EventPortal:
         subscribing on all related events"""
         self.spec_path = spec_path
         
-        with open(spec_path) as f:
-            text_context = f.read()
-            self.spec = yaml.safe_load(text_context)
-
-        version = self.spec.get("openapi")
-        if not version:
-            logging.error("There is no 'openapi' filed in {}".format(spec_path))
-            raise SystemExit
-
-        if int(version.split(".")[0]) < 3:
-            logging.error("The open api version of '{}' is {}, must be 3.x.".format(spec_path, version))
-            raise SystemExit
-
-        self.generate_ep_objects()
-        self.__create_queue()
-        self.__subscribe_on_events()
+        plan = plan_spec(self.loader, spec_path, max_ref_nodes=self.max_ref_nodes)
+        self.syncQueue(plan["subscriptions"])
+
+    def syncQueue(self, topics, previous=None):
+        """Create the queue if needed and subscribe it on the topics, return
+        the subscriptions it was synced to. Given the previous ones of a
+        sync, only their difference is applied and nothing is listed."""
+        if self.max_extra_topics is not None:
+            topics = minimize_subscriptions(topics, self.max_extra_topics, self.multi_level)
+        if previous is None:
+            with phase("queue"):
+                self.__create_queue()
+        with phase("subscribe"):
+            self.__subscribe_on_events(topics, previous)
+        return topics
 
     def __create_queue(self):
-        url = "{}/SEMP/v2/config/msgVpns/{}/queues".format(self.host, self.vpn)
+        url = "{}/SEMP/v2/config/msgVpns/{}/queues".format(self.host, quote(self.vpn, safe=""))
         queue =  {
             "egressEnabled": True,
             "ingressEnabled": True,
@@ -255,31 +587,69 @@ class EventPortal:
             "queueName": self.queueName,
         }
 
-        sempv2("post", url, self.admin_user, self.admin_password, queue)
+        # an existing queue is fine, only its subscriptions are reconciled
+        if sempv2("get", url+"/"+quote(self.queueName, safe=""), self.admin_user,
+                self.admin_password, client=self.client, ignore=("NOT_FOUND",)):
+            logging.info("Queue '{}' already exists".format(self.queueName))
+            return
+        sempv2("post", url, self.admin_user, self.admin_password, queue,
+            client=self.client, ignore=("ALREADY_EXISTS",))
         logging.info("Queue '{}' created successfully".format(self.queueName))
 
-        pass
-
-    def __subscribe_on_events(self):
+    def __subscribe_on_events(self, topics, previous=None):
         url = "{}/SEMP/v2/config/msgVpns/{}/queues/{}/subscriptions".\
-            format(self.host, self.vpn, self.queueName)
-
-        para = re.compile("{[^}]+}")
-        for e, v in self.Events.items():
-            topic = para.sub("*", v["payload"]["topicName"])
-            sub = {"subscriptionTopic":topic}
-            sempv2("post", url, self.admin_user, self.admin_password, sub)
-            logging.info("Queue '{}' subscribed on '{}' successfully".\
-                format(self.queueName, topic))
+            format(self.host, quote(self.vpn, safe=""), quote(self.queueName, safe=""))
+
+        existing = self._getQueueSubscriptions(url) if previous is None else previous
+        missing = [t for t in topics if t not in existing]
+        extra = [t for t in existing if t not in set(topics)]
+        logging.info("Queue '{}': {} subscriptions, {} already exist, {} to add".format(
+            self.queueName, len(topics), len(topics)-len(missing), len(missing)))
+
+        failures = self._run_all([("subscriptions", t, self._subscribe, (url, t)) for t in missing])
+        # the previous subscriptions came from the spec, unlike the listed ones
+        if self.prune or previous is not None:
+            failures += self._run_all([("subscriptions", t, self._unsubscribe, (url, t)) for t in extra])
+        elif extra:
+            logging.warn("Queue '{}' has {} subscriptions which are not in the spec".format(
+                self.queueName, len(extra)))
+        if failures:
+            for _, topic, reason in failures:
+                logging.error("Failed to update subscription '{}': {}".format(topic, reason))
+            raise RuntimeError
+
+    def _getQueueSubscriptions(self, url):
+        topics = []
+        params = {"count": 100}
+        while url:
+            rJson = sempv2("get", url, self.admin_user, self.admin_password,
+                client=self.client, params=params)
+            topics.extend(d["subscriptionTopic"] for d in rJson["data"])
+            # the next page URI already holds the cursor and count
+            url, params = safeget(rJson, "meta", "paging", "nextPageUri"), None
+        return topics
+
+    def _subscribe(self, url, topic):
+        sub = {"subscriptionTopic":topic}
+        sempv2("post", url, self.admin_user, self.admin_password, sub,
+            client=self.client, ignore=("ALREADY_EXISTS",))
+        logging.info("Queue '{}' subscribed on '{}' successfully".\
+            format(self.queueName, topic))
+
+    def _unsubscribe(self, url, topic):
+        sempv2("delete", url+"/"+quote(topic, safe=""), self.admin_user, self.admin_password,
+            client=self.client, ignore=("NOT_FOUND",))
+        logging.info("Queue '{}' unsubscribed from '{}' successfully".\
+            format(self.queueName, topic))
 
 # --------------------------- generate AsyncApi ---------------------------
 
-    def generateAsyncApi(self, application_name):
+    def generateAsyncApi(self, application_name, writer=None):
         # 1. get application id by name
         app_id = self._getObjectIdByName("applications", application_name)
         if not app_id:
             logging.error("Could not find Application '{}'!".format(application_name))
-            raise SystemExit
+            raise SystemExit(1)
 
         # 2. generate AsyncApi
         gen_url = self._base_url+\
@@ -287,48 +657,52 @@ class EventPortal:
         request = {
             "asyncApiVersion": "2.0.0",
         }
-        rJson = rest("post", gen_url, request, token=self.token)
-        print(json.dumps(rJson,indent=2))
+        rJson = rest("post", gen_url, request, token=self.token, client=self.client)
+        (writer or SpecWriter(sys.stdout)).write(rJson)
 
 
 # --------------------------- generate OpenApi ---------------------------
 
-    def generateOpenApi(self, domain_name):
+    def generateOpenApi(self, domain_name, writer=None):
         # 1. get the domain id by name
         domain_obj = self._getObjectByName("applicationDomains", domain_name)        
         if not domain_obj:
             logging.error("Could not find Application Domain '{}'!".format(domain_name))
-            raise SystemExit
+            raise SystemExit(1)
         else:
             domain_id = domain_obj["id"]
         
         # 2. get all events in the given application domain
         query_dict = {"applicationDomainId": domain_id}
-        event_list = self._getAllObjects("events", query_dict)
+        event_list = self._iterAllObjects("events", query_dict)
 
         # 3. filter external events
         event_list = [e for e in event_list if \
             len(e["consumedApplicationIds"])>0]
 #            len(e["producedApplicationIds"])==0 and len(e["consumedApplicationIds"])>0]
 
-        # 4. get all related schemas
-        schema_IDs = set([e["schemaId"] for e in event_list if e["schemaId"]])
-        query_dict = {
-            "ids": ",".join(list(schema_IDs)),
-        }
-        schema_list = self._getAllObjects("schemas", query_dict)
+        # 4. get all related schemas, in chunks of ids to stay within URL
+        #    length limits
+        schema_IDs = sorted(set([e["schemaId"] for e in event_list if e["schemaId"]]))
+        chunks = [schema_IDs[i:i+self.ids_chunk_size] \
+            for i in range(0, len(schema_IDs), self.ids_chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            schema_list = [s for chunk in executor.map(
+                lambda ids: self._getAllObjects("schemas", {"ids": ",".join(ids)}), chunks)
+                for s in chunk]
 
         # 5. generate openapi spec
-        generateOpenAPISpec(domain_name, domain_obj["description"], event_list, schema_list)
+        generateOpenAPISpec(domain_name, domain_obj["description"], event_list, schema_list, writer)
 
 
 # --------------------------- helper methods ---------------------------
 
     def _getObjectByName(self, coll, name):
-        coll_url = "{}/api/v1/eventPortal/{}?name={}".format(
-            self._base_url, coll, name
+        coll_url = "{}/api/v1/eventPortal/{}".format(
+            self._base_url, coll
         )
-        rJson = rest("get", coll_url, token=self.token)
+        rJson = rest("get", coll_url, params={"name": name},
+            token=self.token, client=self.client, cache=self.http_cache)
         if len(rJson["data"]) == 0:
             return None
         else:
@@ -339,21 +713,57 @@ class EventPortal:
         return obj["id"] if obj else None
 
     def _getAllObjects(self, coll, query_dict):
-        params = {
-            "pageSize": 100,
-            "pageNumber": 1
-        }
-        params.update(query_dict)
-
-        data_list = []
-        while params["pageNumber"]:
-            get_url = "{}/api/v1/eventPortal/{}".format(
-                self._base_url, coll
-            )
-            rJson = rest("get", get_url, params=params, token=self.token)
-            data_list.extend(rJson['data'])
-
-            pagination = safeget(rJson, "meta", "pagination")
-            params["pageNumber"]=pagination["nextPage"]
-        
-        return data_list
\ No newline at end of file
+        return list(self._iterAllObjects(coll, query_dict))
+
+    def _getPage(self, coll, query_dict, pageNumber):
+        get_url = "{}/api/v1/eventPortal/{}".format(
+            self._base_url, coll
+        )
+        params = dict(query_dict, pageSize=self.page_size, pageNumber=pageNumber)
+        return rest("get", get_url, params=params, token=self.token, client=self.client,
+            cache=self.http_cache)
+
+    def _iterAllObjects(self, coll, query_dict, first=None):
+        # Yield the objects of a collection page by page, from the given
+        # first page if it was already fetched. Once the first page tells
+        # the number of pages, the next ones are prefetched concurrently.
+        get_page = lambda pageNumber: self._getPage(coll, query_dict, pageNumber)
+
+        rJson = first or get_page(1)
+        yield from rJson['data']
+        pagination = safeget(rJson, "meta", "pagination") or {}
+        totalPages = pagination.get("totalPages")
+        if not totalPages or self.prefetch < 1:
+            # unknown number of pages, follow them one by one
+            while pagination.get("nextPage"):
+                rJson = get_page(pagination["nextPage"])
+                yield from rJson['data']
+                pagination = safeget(rJson, "meta", "pagination") or {}
+            return
+
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            pages = iter(range(2, totalPages+1))
+            pending = [executor.submit(get_page, n) for n in itertools.islice(pages, self.prefetch)]
+            while pending:
+                rJson = pending.pop(0).result()
+                for n in itertools.islice(pages, 1):
+                    pending.append(executor.submit(get_page, n))
+                yield from rJson['data']
+
+    def _indexAllObjects(self, coll, query_dict, max_pages=None):
+        # None if the collection has more than max_pages pages
+        first = self._getPage(coll, query_dict, 1)
+        pagination = safeget(first, "meta", "pagination") or {}
+        if pagination.get("count") is not None:
+            pages = -(-pagination["count"] // self.page_size)
+        else:
+            pages = pagination.get("totalPages")
+        if max_pages is not None and pages and pages > max_pages:
+            logging.info("The inventory of {} spans {} pages, looked up by name instead".format(
+                coll, pages))
+            return None
+        index = {}
+        for obj in self._iterAllObjects(coll, query_dict, first):
+            # keep the first one, like _getObjectByName does
+            index.setdefault(obj["name"], obj)
+        return index
@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SPEC_SUFFIXES = (".json", ".yaml", ".yml")
+
+class ExistenceIndex:
+    """Name index of the schemas and events collections, shared by all
+    specs imported into the same application domain.
+
+    Each collection is paged through once, on first use, and kept up to
+    date with the objects the imports create, update or delete. The
+    objects of the other collections, like the domain itself, are known
+    once an import created them. The specs of a domain run concurrently, so
+    an object is only created while holding the lock of its name."""
+
+    def __init__(self):
+        self._indexes = {}
+        # coll -> {name: obj} of the collections which are not indexed
+        self._created = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, coll, fetch):
+        """Return the index of coll, built by fetch() on first use. fetch()
+        may return None, e.g. when the collection is too large, it is then
+        tried again on the next use."""
+        with self._lock:
+            if coll not in self._indexes:
+                index = fetch()
+                if index is None: return None
+                self._indexes[coll] = index
+            return self._indexes[coll]
+
+    def find(self, coll, name):
+        """Return the object of that name known to exist, if any"""
+        with self._lock:
+            return self._indexes.get(coll, {}).get(name) or self._created.get(coll, {}).get(name)
+
+    def lock(self, coll, name):
+        """Return the lock to hold while creating the object of that name"""
+        with self._lock:
+            return self._locks.setdefault((coll, name), threading.Lock())
+
+    def put(self, coll, obj):
+        with self._lock:
+            if coll in self._indexes:
+                self._indexes[coll][obj["name"]] = obj
+            else:
+                self._created.setdefault(coll, {})[obj["name"]] = obj
+
+    def discard(self, coll, name):
+        with self._lock:
+            for objs in (self._indexes, self._created):
+                if coll in objs:
+                    objs[coll].pop(name, None)
+
+def find_specs(paths):
+    """Expand directories into the spec files they hold"""
+    specs = []
+    for path in paths:
+        if os.path.isdir(path):
+            specs.extend(sorted(os.path.join(path, f) for f in os.listdir(path) \
+                if f.endswith(SPEC_SUFFIXES) and os.path.isfile(os.path.join(path, f))))
+        else:
+            specs.append(path)
+    return specs
+
+def load_mapping(path):
+    """Load the spec to domain/application mapping of a batch import.
+
+    A mapping is a YAML or JSON file keyed by spec path (relative to the
+    mapping file) or file name:
+
+        orders.yaml:
+          domain: Shop
+          application: Orders
+          pub: true
+    """
+    import yaml
+    with open(path) as f:
+        mapping = yaml.safe_load(f) or {}
+    base = os.path.dirname(os.path.abspath(path))
+    resolved = {}
+    for spec, target in mapping.items():
+        resolved[spec] = target
+        resolved[os.path.normpath(os.path.join(base, spec))] = target
+    return resolved
+
+def plan_batch(paths, mapping=None, domain=None, application=None, pub=None):
+    """Return the list of (spec, domain, application, pub) jobs of a batch,
+    unmapped specs go to the given domain, application and pub flag. Where
+    none is given, a plan keeps its own and a spec goes to the default
+    domain with an application named after the file, see
+    default_application."""
+    jobs = []
+    for spec in find_specs(paths):
+        target = {}
+        if mapping:
+            target = mapping.get(os.path.normpath(os.path.abspath(spec))) or \
+                mapping.get(spec) or mapping.get(os.path.basename(spec)) or {}
+        jobs.append((spec,
+            target.get("domain", domain),
+            target.get("application", application),
+            target.get("pub", pub)))
+    return jobs
+
+def default_application(spec):
+    """Application of a spec of a batch without any given one"""
+    return os.path.splitext(os.path.basename(spec))[0]
+
+def import_batch(jobs, make_portal, spec_concurrency=4, loader=None):
+    """Import every (spec, domain, application, pub) job and return one
+    summary per spec, failures don't stop the other specs.
+
+    Up to spec_concurrency specs run concurrently, whatever their domain.
+    The specs of the same application domain share its ExistenceIndex, so
+    that an object they have in common is only looked up and created once.
+    make_portal(domain, application, pub, index) returns the EventPortal
+    of a job, a domain or pub of None is the one of the plan. The spec of a
+    job is released from the SpecLoader loader, if any, once imported."""
+    indexes = {domain: ExistenceIndex() for domain in set(job[1] for job in jobs)}
+
+    def run_job(job):
+        spec, domain, application, pub = job
+        summary = {"spec": spec, "domain": domain or "-", "application": application or "-",
+            "ok": False, "schemas": 0, "events": 0, "error": None}
+        start = time.perf_counter()
+        try:
+            ep = make_portal(domain, application or default_application(spec), pub, indexes[domain])
+            ep.importOpenAPISpec(spec, domain, application,
+                default_application=default_application(spec))
+            summary.update(ok=True, domain=ep.domainName, application=ep.appName,
+                schemas=len(ep.Schemas), events=len(ep.Events))
+        except (Exception, SystemExit) as e:
+            summary["error"] = first_line(e)
+            logging.error("Import of '{}' failed: {}".format(spec, summary["error"]))
+        if loader is not None: loader.release(spec)
+        summary["seconds"] = time.perf_counter() - start
+        return summary
+
+    # in the order of the jobs
+    with ThreadPoolExecutor(max_workers=max(1, spec_concurrency)) as executor:
+        return list(executor.map(run_job, jobs))
+
+def first_line(e):
+    """First line of the message of an exception, a bare SystemExit only
+    holds its exit status and the error was logged before it"""
+    text = "" if type(e) is SystemExit else str(e)
+    return (text or type(e).__name__).splitlines()[0]
+
+def print_summary(summaries, stream):
+    stream.write("\n{:<40} {:<20} {:<20} {:>7} {:>7} {:>8}  {}\n".format(
+        "Spec", "Domain", "Application", "schemas", "events", "seconds", "result"))
+    for s in summaries:
+        stream.write("{:<40} {:<20} {:<20} {:>7} {:>7} {:>8.2f}  {}\n".format(
+            os.path.basename(s["spec"]), s["domain"], s["application"], s["schemas"],
+            s["events"], s["seconds"], "ok" if s["ok"] else "FAILED: "+s["error"]))
+    failed = sum(1 for s in summaries if not s["ok"])
+    stream.write("\n{} specs imported, {} failed\n".format(len(summaries) - failed, failed))
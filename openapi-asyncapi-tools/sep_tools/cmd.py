@@ -1,35 +1,191 @@
 import click
 import logging
+import os
+import sys
 
-from .EventPortal import EventPortal
+# only what the group needs is imported here, the modules of a command
+# and their dependencies (requests, PyYAML) are imported when it runs
+from .loader import default_cache_dir
+from .metrics import enable_metrics
+from .output import FORMATS, SpecWriter, open_output
+from .util import configure_client, get_client
 
 logging.basicConfig(level=logging.INFO)
 
 @click.group()
 @click.version_option()
-def cli():
-    pass
+@click.option('--pool-size', default=10, show_default=True,
+    help='Maximum number of pooled keep-alive connections per host, raised to the concurrency of the command')
+@click.option('--timeout', default=30.0, show_default=True,
+    help='Timeout in seconds of every HTTP request')
+@click.option('--retries', default=3, show_default=True,
+    help='Number of retries with backoff on 429/5xx responses')
+@click.option('--rate-limit', default=0.0, show_default=True,
+    help='Maximum number of requests per second, 0 for no limit')
+@click.option('--cache-dir', default=default_cache_dir, envvar='SEP_CACHE_DIR',
+    type=click.Path(file_okay=False), show_default="~/.cache/sep-tools",
+    help='Directory of the on-disk caches, could be set with env variable [SEP_CACHE_DIR]')
+@click.option('--no-cache', default=False, is_flag=True,
+    help='Do not read or write any on-disk cache')
+@click.option('--cache-ttl', default=300, show_default=True, type=click.IntRange(min=0),
+    help='Seconds Event Portal listings of the generate commands are reused without any request, listings with an ETag or Last-Modified are always revalidated')
+@click.option('--page-size', default=100, show_default=True, type=click.IntRange(min=1),
+    help='Number of objects per page of Event Portal listings')
+@click.option('--prefetch', default=4, show_default=True, type=click.IntRange(min=0),
+    help='Number of pages of Event Portal listings fetched ahead concurrently')
+@click.option('--max-in-flight', default=0, show_default=True, type=click.IntRange(min=0),
+    help='Maximum number of requests in flight over all threads, 0 for no limit')
+@click.option('--base-url', default="https://solace.cloud", envvar='SEP_BASE_URL', show_default=True,
+    help='Base URL of the Event Portal REST API, could be set with env variable [SEP_BASE_URL]')
+@click.option('--profile', default=False, is_flag=True,
+    help='Print the time of every phase and the latency of every endpoint at exit')
+@click.option('--metrics', type=click.Path(dir_okay=False, writable=True),
+    help='Write the phase times and the per endpoint request metrics as JSON to this file at exit')
+@click.pass_context
+def cli(ctx, pool_size, timeout, retries, rate_limit, cache_dir, no_cache, cache_ttl, page_size,
+    prefetch, max_in_flight, base_url, profile, metrics):
+    # one shared connection pool for the whole run
+    configure_client(pool_size=pool_size, timeout=timeout, retries=retries,
+        rate_limit=rate_limit, max_in_flight=max_in_flight)
+    if profile or metrics:
+        recorder = enable_metrics()
+        # reported even if the command fails
+        if profile: ctx.call_on_close(lambda: recorder.report(sys.stderr))
+        if metrics: ctx.call_on_close(lambda: recorder.write_json(metrics))
+    ctx.obj = {
+        "cache_dir": None if no_cache else cache_dir,
+        "cache_ttl": cache_ttl,
+        "page_size": page_size,
+        "prefetch": prefetch,
+        "base_url": base_url,
+    }
+
+def http_cache(obj):
+    # GET responses of the read-only commands are cached on disk
+    if not obj["cache_dir"]: return None
+    from .httpcache import HttpCache
+    cache = HttpCache(obj["cache_dir"], obj["cache_ttl"])
+    click.get_current_context().call_on_close(lambda: logging.info(
+        "HTTP cache: {hits} hits, {revalidated} revalidated, {misses} misses".format(**cache.stats)))
+    return cache
+
+# -------------------------- plan --------------------------
+@cli.command(name="plan")
+@click.argument('open_api_spec_file', type=click.Path(exists=True))
+@click.option('--domain',
+    help='Application Domain, by default the one of a plan or TestDomain')
+@click.option('--pub/--sub', default=None,
+    help='Publish all related events insted of subscribe on them, by default the setting of a plan or --sub')
+@click.option('--application',
+    help='Application, by default the one of a plan or TestApp')
+@click.option('--max-ref-nodes', default=2000, show_default=True, type=click.IntRange(min=0),
+    help='Nested $ref expanding to more nodes is replaced by a stub, 0 for no limit')
+@click.option('--dedupe-schemas', default=False, is_flag=True,
+    help='Share one schema between all events whose request bodies are identical')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+    help='File to write the plan to, instead of stdout')
+@click.pass_obj
+def plan(obj, open_api_spec_file, domain, pub, application, max_ref_nodes, dedupe_schemas, output):
+    """Compute offline the domain, application, schemas, events and queue
+    subscriptions of the specified OpenAPI 3.0 specification. The plan could
+    be passed to importOpenAPI and createQueue instead of the spec"""
+    from .loader import SpecLoader
+    from .plan import plan_spec, write_plan
+
+    plan = plan_spec(SpecLoader(obj["cache_dir"]), open_api_spec_file, domain,
+        application, pub, max_ref_nodes, dedupe_schemas)
+    logging.info("Plan of '{}': {} schemas, {} events, {} subscriptions".format(
+        open_api_spec_file, len(plan["schemas"]), len(plan["events"]),
+        len(plan["subscriptions"])))
+    with open_output(output) as f:
+        write_plan(plan, f)
 
 # -------------------------- importOpenAPI --------------------------
 @cli.command(name="importOpenAPI")
-@click.argument('open_api_spec_file', type=click.Path(exists=True))
-@click.option('--domain', default="TestDomain", show_default=True, 
-    help='Application Domain')
-@click.option('--pub', default=False, show_default=True, is_flag=True,
-    help='Publish all related events insted of subscribe on them')
-@click.option('--application', default="TestApp", show_default=True,
-    help='Application')
+@click.argument('open_api_spec_files', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--domain',
+    help='Application Domain, by default the one of a plan or TestDomain')
+@click.option('--pub/--sub', default=None,
+    help='Publish all related events insted of subscribe on them, by default the setting of a plan or --sub')
+@click.option('--application',
+    help='Application, by default the one of a plan or TestApp, named after the spec file when importing several specs')
 @click.option('--token', envvar='EVENT_PORTAL_TOKEN', required=True,
     help="The API token of Solace's Cloud REST API, could be set with env variable [EVENT_PORTAL_TOKEN]")
-def cmdImportOpenAPI(open_api_spec_file, domain, pub, application, token):
+@click.option('--concurrency', default=8, show_default=True, type=click.IntRange(min=1),
+    help='Maximum number of concurrent requests while checking and creating objects')
+@click.option('--bulk-threshold', default=50, show_default=True, type=click.IntRange(min=0),
+    help='Check existed schemas and events against one paged inventory above this number of objects')
+@click.option('--max-ref-nodes', default=2000, show_default=True, type=click.IntRange(min=0),
+    help='Nested $ref expanding to more nodes is replaced by a stub, 0 for no limit')
+@click.option('--manifest', type=click.Path(dir_okay=False),
+    help='State file of the last sync, only changes since then are pushed and it is updated on success')
+@click.option('--reconcile', default=False, is_flag=True,
+    help='Update existing schemas and events whose content differs from the spec')
+@click.option('--prune', default=False, is_flag=True,
+    help='Delete events of the application which are not in the spec, and the schemas only they use, single spec only')
+@click.option('--mapping', type=click.Path(exists=True, dir_okay=False),
+    help='YAML/JSON file mapping spec files to their domain, application and pub flag')
+@click.option('--spec-concurrency', default=4, show_default=True, type=click.IntRange(min=1),
+    help='Maximum number of specs imported concurrently when importing several specs')
+@click.option('--dedupe-schemas', default=False, is_flag=True,
+    help='Share one schema between all events whose request bodies are identical')
+@click.option('--journal', type=click.Path(dir_okay=False),
+    help='Checkpoint journal of the import, by default in the cache directory')
+@click.option('--resume', default=False, is_flag=True,
+    help='Resume a failed import from its journal instead of starting over')
+@click.pass_obj
+def cmdImportOpenAPI(obj, open_api_spec_files, domain, pub, application, token, concurrency, bulk_threshold,
+    max_ref_nodes, manifest, reconcile, prune, mapping, spec_concurrency, dedupe_schemas, journal, resume):
     """Generate an Application based on the specified OpenAPI 3.0 specification by
-    subscribing on all related events"""
+    subscribing on all related events, the file could also be a plan of the plan
+    command. Several files or directories of specs are imported in one batch"""
+    from .EventPortal import EventPortal
+    from .batch import import_batch, load_mapping, plan_batch, print_summary
+    from .journal import Journal
+    from .loader import SpecLoader
+    from .manifest import Manifest
+    from .plan import target_domain
 
-    logging.info("Import file '{}' to build Application '{}' within Domain '{}'".format(
-        open_api_spec_file, application, domain
-    ))
-    ep = EventPortal(token, pub)
-    ep.importOpenAPISpec(open_api_spec_file, domain, application)
+    if resume and not (journal or obj["cache_dir"]):
+        raise click.UsageError("--resume needs a --journal or the cache directory")
+    loader = SpecLoader(obj["cache_dir"])
+    def make_portal(domain, application, pub, index=None):
+        # no journal at all without a cache directory, the target it was
+        # written for is checked on --resume
+        journal_path = journal or obj["cache_dir"] and \
+            Journal.default_path(obj["cache_dir"], domain, application)
+        return EventPortal(token, pub, concurrency=concurrency, bulk_threshold=bulk_threshold,
+            max_ref_nodes=max_ref_nodes, loader=loader,
+            reconcile=reconcile, prune=prune, page_size=obj["page_size"], prefetch=obj["prefetch"],
+            base_url=obj["base_url"], index=index,
+            journal=Journal(journal_path, resume) if journal_path else None,
+            dedupe_schemas=dedupe_schemas)
+
+    if len(open_api_spec_files) == 1 and os.path.isfile(open_api_spec_files[0]) and not mapping:
+        open_api_spec_file = open_api_spec_files[0]
+        ep = make_portal(domain, application, pub)
+        ep.importOpenAPISpec(open_api_spec_file, domain, application,
+            Manifest(manifest) if manifest else None)
+        return
+
+    if manifest or journal:
+        raise click.UsageError("--manifest and --journal only apply to the import of a single spec")
+    if prune:
+        # the specs of a domain would delete what the others import
+        raise click.UsageError("--prune only applies to the import of a single spec")
+    jobs = plan_batch(open_api_spec_files, load_mapping(mapping) if mapping else None,
+        domain, None, pub)
+    # grouped by the domain they go to, a plan keeps its own
+    jobs = [(spec, job_domain or target_domain(loader, spec), job_application, job_pub) \
+        for spec, job_domain, job_application, job_pub in jobs]
+    domains = len(set(j[1] for j in jobs))
+    logging.info("Import {} specs into {} Domains".format(len(jobs), domains))
+    # the specs are imported concurrently, each with its own threads
+    get_client(min(spec_concurrency, len(jobs)) * (concurrency + obj["prefetch"]))
+    summaries = import_batch(jobs, make_portal, spec_concurrency, loader)
+    print_summary(summaries, sys.stdout)
+    if not all(s["ok"] for s in summaries):
+        sys.exit(1)
 
 # -------------------------- importOpenAPI --------------------------
 @cli.command(name="createQueue")
@@ -44,10 +200,28 @@ def cmdImportOpenAPI(open_api_spec_file, domain, pub, application, token):
     help='The name of the message vpn')
 @click.option('--queue', required=True,
     help='The name of the queue to create')
-def createQueue(open_api_spec_file, admin_user, admin_password, host, vpn, queue):
+@click.option('--concurrency', default=8, show_default=True, type=click.IntRange(min=1),
+    help='Maximum number of concurrent subscription requests')
+@click.option('--prune', default=False, is_flag=True,
+    help='Remove subscriptions of an existing queue which are not in the spec')
+@click.option('--minimize', default=False, is_flag=True,
+    help='Collapse the subscriptions into Solace wildcards at the method level (*)')
+@click.option('--max-extra-topics', default=0, show_default=True, type=click.IntRange(min=0),
+    help='Number of extra topics with other HTTP methods a wildcard of --minimize may match')
+@click.option('--multi-level', default=False, is_flag=True,
+    help='Also let --minimize collapse subscriptions into prefix/>, which matches any topic below the prefix, '\
+        'the known topics below it count against --max-extra-topics')
+@click.pass_obj
+def createQueue(obj, open_api_spec_file, admin_user, admin_password, host, vpn, queue, concurrency, prune,
+    minimize, max_extra_topics, multi_level):
     """Generate a queue based on the specified OpenAPI 3.0 specification by
-    subscribing on all related events"""
+    subscribing on all related events, the file could also be a plan of the plan
+    command"""
+    from .EventPortal import EventPortal
+    from .loader import SpecLoader
 
+    if multi_level and not minimize:
+        raise click.UsageError("--multi-level only applies with --minimize")
     if host[-1]=='/':
         host=host[:-1]
 
@@ -57,36 +231,128 @@ def createQueue(open_api_spec_file, admin_user, admin_password, host, vpn, queue
         admin_password=admin_password,
         host=host,
         vpn=vpn,
-        queueName=queue,)
+        queueName=queue,
+        concurrency=concurrency,
+        loader=SpecLoader(obj["cache_dir"]),
+        prune=prune,
+        max_extra_topics=max_extra_topics if minimize else None,
+        multi_level=multi_level)
     ep.createQueue(open_api_spec_file)
 
+# -------------------------- watch --------------------------
+@cli.command(name="watch")
+@click.argument('open_api_spec_files', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--domain',
+    help='Application Domain, by default the one of a plan or TestDomain')
+@click.option('--pub/--sub', default=None,
+    help='Publish all related events insted of subscribe on them, by default the setting of a plan or --sub')
+@click.option('--application',
+    help='Application, by default the one of a plan or named after the spec file')
+@click.option('--mapping', type=click.Path(exists=True, dir_okay=False),
+    help='YAML/JSON file mapping spec files to their domain, application and pub flag')
+@click.option('--token', envvar='EVENT_PORTAL_TOKEN',
+    help="The API token of Solace's Cloud REST API, could be set with env variable [EVENT_PORTAL_TOKEN]")
+@click.option('--concurrency', default=8, show_default=True, type=click.IntRange(min=1),
+    help='Maximum number of concurrent requests while checking and creating objects')
+@click.option('--max-ref-nodes', default=2000, show_default=True, type=click.IntRange(min=0),
+    help='Nested $ref expanding to more nodes is replaced by a stub, 0 for no limit')
+@click.option('--reconcile', default=False, is_flag=True,
+    help='Update existing schemas and events whose content differs from the spec on the first sync')
+@click.option('--dedupe-schemas', default=False, is_flag=True,
+    help='Share one schema between all events whose request bodies are identical')
+@click.option('--queue',
+    help='The name of a queue to subscribe on the events of all specs')
+@click.option('--admin-user', default='admin', show_default=True,
+    help='The username of the management user')
+@click.option('--admin-password', default='admin', show_default=True,
+    envvar='SOL_ADMIN_PWD', help='The password of the management user, could be set by env variable [SOL_ADMIN_PWD]')
+@click.option('--host', default='http://localhost:8080', show_default=True,
+    help='URL to access the management endpoint of the broker')
+@click.option('--vpn', default='default', show_default=True,
+    help='The name of the message vpn')
+@click.option('--prune', default=False, is_flag=True,
+    help='Remove subscriptions of the queue which are not in the specs on the first sync')
+@click.option('--interval', default=0.5, show_default=True, type=click.FloatRange(min=0.05),
+    help='Seconds between two polls of the spec files')
+@click.option('--debounce', default=0.5, show_default=True, type=click.FloatRange(min=0),
+    help='Seconds a spec must stay unchanged before it is synced')
+@click.pass_obj
+def watch(obj, open_api_spec_files, domain, pub, application, mapping, token, concurrency,
+    max_ref_nodes, reconcile, dedupe_schemas, queue, admin_user, admin_password, host, vpn,
+    prune, interval, debounce):
+    """Import the specs, or the specs of directories, like importOpenAPI and
+    subscribe a queue on their events like createQueue, then keep them synced
+    on every change until interrupted. Only what changed since the previous
+    sync of a spec is pushed"""
+    from .EventPortal import EventPortal
+    from .batch import load_mapping
+    from .loader import SpecLoader
+    from .watch import Watcher
+
+    if not token and not queue:
+        raise click.UsageError("Nothing to sync, give a --token and/or a --queue")
+    loader = SpecLoader(obj["cache_dir"])
+    def make_portal(domain, application, pub, index=None):
+        return EventPortal(token, pub, concurrency=concurrency, max_ref_nodes=max_ref_nodes,
+            loader=loader, reconcile=reconcile, page_size=obj["page_size"],
+            prefetch=obj["prefetch"], base_url=obj["base_url"], index=index,
+            dedupe_schemas=dedupe_schemas)
+    queue_portal = None
+    if queue:
+        queue_portal = EventPortal(admin_user=admin_user, admin_password=admin_password,
+            host=host.rstrip("/"), vpn=vpn, queueName=queue, concurrency=concurrency,
+            loader=loader, prune=prune)
+
+    watcher = Watcher(open_api_spec_files, loader, make_portal if token else None, queue_portal,
+        load_mapping(mapping) if mapping else None, domain, application, pub, max_ref_nodes,
+        dedupe_schemas, interval, debounce)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+
 # -------------------------- generateAsyncAPI --------------------------
 @cli.command(name="generateAsyncAPI")
 @click.argument('application')
 @click.option('--token', envvar='EVENT_PORTAL_TOKEN', required=True,
     help="The API token of Solace's Cloud REST API, could be set with env variable [EVENT_PORTAL_TOKEN]")
-def generateAsyncAPI(application, token):
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+    help='File to write the spec to, instead of stdout')
+@click.option('--format', 'output_format', type=click.Choice(FORMATS), default='json', show_default=True,
+    help='Output format of the spec')
+@click.pass_obj
+def generateAsyncAPI(obj, application, token, output, output_format):
     """Generate an AsyncAPI spec for the specified Application"""
+    from .EventPortal import EventPortal
 
     logging.info("Generate AsyncAPI spec for the Application '{}'".format(
          application
     ))
-    ep = EventPortal(token)
-    ep.generateAsyncApi(application)
+    ep = EventPortal(token, base_url=obj["base_url"], http_cache=http_cache(obj))
+    with open_output(output) as f:
+        ep.generateAsyncApi(application, SpecWriter(f, output_format))
 
 # -------------------------- generateOpenAPI --------------------------
 @cli.command(name="generateOpenAPI")
 @click.argument('domain-name')
 @click.option('--token', envvar='EVENT_PORTAL_TOKEN', required=True,
     help="The API token of Solace's Cloud REST API, could be set with env variable [EVENT_PORTAL_TOKEN]")
-def generateOpenApi(domain_name, token):
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+    help='File to write the spec to, instead of stdout')
+@click.option('--format', 'output_format', type=click.Choice(FORMATS), default='json', show_default=True,
+    help='Output format of the spec')
+@click.pass_obj
+def generateOpenApi(obj, domain_name, token, output, output_format):
     """Generate a OpenAPI spec for the specified Domain that represents all the external events that the domain receives"""
+    from .EventPortal import EventPortal
 
     logging.info("Generate OpenAPI spec for the Application Domain '{}'".format(
          domain_name
     ))
-    ep = EventPortal(token)
-    ep.generateOpenApi(domain_name)
+    ep = EventPortal(token, page_size=obj["page_size"], prefetch=obj["prefetch"],
+        base_url=obj["base_url"], http_cache=http_cache(obj))
+    with open_output(output) as f:
+        ep.generateOpenApi(domain_name, SpecWriter(f, output_format))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+class HttpCache:
+    """On-disk cache of GET responses for the read-only commands.
+
+    An entry is always revalidated with If-None-Match/If-Modified-Since when
+    the server sent an ETag or Last-Modified, so that changes made meanwhile
+    are seen. Without them, an entry younger than ttl seconds is used
+    without any request and an older one is fetched again. Entries are
+    keyed by url, query and token, so that accounts don't share entries."""
+
+    def __init__(self, cache_dir, ttl=300):
+        self.directory = os.path.join(cache_dir, "http")
+        self.ttl = ttl
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url, params=None, token=None):
+        query = urlencode(sorted((params or {}).items()))
+        raw = json.dumps([url, query, hashlib.sha256((token or "").encode()).hexdigest()])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key+".json")
+
+    def load(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def fresh(self, entry):
+        return time.time() - entry["stored"] < self.ttl
+
+    @staticmethod
+    def validators(entry):
+        # conditional request headers of an entry
+        headers = {}
+        if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+        if entry.get("lastModified"): headers["If-Modified-Since"] = entry["lastModified"]
+        return headers
+
+    def store(self, key, r):
+        self._write(key, {
+            "stored": time.time(),
+            "etag": r.headers.get("ETag"),
+            "lastModified": r.headers.get("Last-Modified"),
+            "body": r.text,
+        })
+
+    def touch(self, key, entry):
+        # revalidated, fresh for another ttl
+        self._write(key, dict(entry, stored=time.time()))
+
+    def count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def _write(self, key, entry):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning("Could not write HTTP cache {}: {}".format(self.directory, e))
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+class Journal:
+    """Checkpoint journal of an import, one JSON line per object as soon as
+    its id is known, so that a failed import can be resumed without looking
+    up or creating again what is already done.
+
+    The first line tells the domain and application of the import:
+
+        {"version": 1, "domain": ..., "application": ...}
+        {"op": "create", "coll": "schemas", "name": ..., "id": ..., "hash": ...}
+        {"op": "found", "coll": "events", "name": ..., "id": ...}
+        {"op": "found", "coll": "events", "name": ..., "id": ..., "hash": ..., "schemaId": ...}
+        {"op": "update", "coll": "events", "name": ..., "id": ..., "hash": ...}
+        {"op": "delete", "coll": "schemas", "name": ..., "id": ...}
+        {"op": "link", "coll": "applications", "name": ..., "id": ..., "eventIds": [...]}
+
+    A found object carries a hash once reconciled with the same content as
+    the spec, and an event the schema id it has in Event Portal. The journal
+    is removed once the import succeeded.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.resume = resume
+        self._file = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default_path(cache_dir, domain, application):
+        key = hashlib.sha256(json.dumps([domain, application]).encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, "journals", key+".jsonl")
+
+    def start(self, domain, application):
+        """Start journaling an import, return the objects of the previous
+        run to resume from: {coll: {name: last entry}}"""
+        entries = self._load(domain, application) if self.resume else {}
+        header = {"version": self.VERSION, "domain": domain, "application": application}
+        # rewrite it compacted, then append to it
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps(header)+"\n")
+            for coll_entries in entries.values():
+                for entry in coll_entries.values():
+                    f.write(json.dumps(entry)+"\n")
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a")
+        return entries
+
+    def _load(self, domain, application):
+        entries = {}
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            logging.info("No journal '{}' to resume from".format(self.path))
+            return entries
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if header.get("version") != self.VERSION or header.get("domain") != domain or \
+            header.get("application") != application:
+            logging.warning("Journal '{}' doesn't match, not resuming".format(self.path))
+            return entries
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line of a killed run may be cut off
+                continue
+            entries.setdefault(entry["coll"], {})[entry["name"]] = entry
+        logging.info("Resuming from journal '{}' with {} objects".format(
+            self.path, sum(len(v) for v in entries.values())))
+        return entries
+
+    def record(self, op, coll, name, obj_id, **extra):
+        if self._file is None: return
+        entry = dict(op=op, coll=coll, name=name, id=obj_id, **extra)
+        with self._lock:
+            self._file.write(json.dumps(entry)+"\n")
+            # one line per confirmed object, on disk before the next request
+            self._file.flush()
+
+    def finish(self):
+        """Drop the journal of a successful import"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+# bump it whenever the layout of the cached entries changes
+CACHE_VERSION = b"4"
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "sep-tools")
+
+def parse_spec(raw):
+    """Parse the bytes of an OpenAPI spec, JSON first and YAML otherwise"""
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    if raw.lstrip()[:1] in (b"{", b"["):
+        try:
+            return _json_loads(raw)
+        except ValueError:
+            # JSON-like YAML, e.g. with comments or trailing commas
+            pass
+    return _yaml_load(raw)
+
+# the parsers are only imported once a spec is parsed, not at startup
+
+def _json_loads(raw):
+    try:
+        import orjson
+    except ImportError:
+        return json.loads(raw)
+    return orjson.loads(raw)
+
+def _yaml_load(raw):
+    import yaml
+    try:
+        # the libyaml based loader is an order of magnitude faster
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+    return yaml.load(raw, Loader=SafeLoader)
+
+def _is_json(node):
+    # whether node is the same once loaded back from JSON, YAML specs may
+    # hold e.g. integer keys or dates
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if not all(isinstance(k, str) for k in node): return False
+            stack.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            stack.extend(node)
+        elif not (node is None or isinstance(node, (str, int, float, bool))):
+            return False
+    return True
+
+class SpecCache:
+    """On-disk cache of parsed specs and their expanded references, keyed
+    by the hash of the spec content, so unchanged files skip parsing.
+
+    Entries are plain JSON, a cache directory shared e.g. between CI jobs
+    holds nothing that is executed when loaded. The small header of a spec
+    is kept in a file of its own, next to its entry."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, "specs")
+
+    def _path(self, digest, part):
+        return os.path.join(self.cache_dir, digest+part+".json")
+
+    def get(self, digest, part=""):
+        try:
+            with open(self._path(digest, part), "rb") as f:
+                return _json_loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("Ignoring corrupted spec cache entry {}: {}".format(digest+part, e))
+            return None
+
+    def put(self, digest, entry):
+        if not _is_json(entry["spec"]):
+            logging.info("Spec {} can't be cached as JSON, not cached".format(digest))
+            return
+        self._write(digest, "", entry)
+
+    def put_header(self, digest, header):
+        self._write(digest, ".header", header)
+
+    def _write(self, digest, part, doc):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "w") as f:
+                json.dump(doc, f, separators=(",", ":"))
+            os.replace(tmp, self._path(digest, part))
+        except OSError as e:
+            logging.warning("Could not write spec cache {}: {}".format(self.cache_dir, e))
+
+class SpecLoader:
+    """Load OpenAPI specs, through the SpecCache when a cache_dir is given.
+
+    The cache entry of a spec holds the parsed document and the memo of
+    its RefResolver per max_nodes setting. It is written once the memo is
+    known. A loaded spec is kept in memory until its file changes or it is
+    released, so that it is only parsed once."""
+
+    def __init__(self, cache_dir=None):
+        self.cache = SpecCache(cache_dir) if cache_dir else None
+        self._entries = {}
+        # digest -> header of the spec, see header()
+        self._headers = {}
+        # digest of the last load of every path, only the entries of the
+        # current content are kept, e.g. while a spec is being edited
+        self._digests = {}
+        # the specs of a batch are loaded concurrently
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read(spec_path):
+        with open(spec_path, "rb") as f:
+            raw = f.read()
+        return raw, hashlib.sha256(CACHE_VERSION+raw).hexdigest()
+
+    def load(self, spec_path):
+        """Return (spec, digest) of the given file"""
+        raw, digest = self._read(spec_path)
+        entry = self._load(spec_path, raw, digest)
+        return entry["spec"], digest
+
+    def _load(self, spec_path, raw, digest):
+        entry = self._entries.get(digest)
+        if entry is None:
+            entry = self.cache.get(digest) if self.cache else None
+            if entry is None:
+                entry = {"spec": parse_spec(raw), "resolved": {}}
+            else:
+                logging.info("Loaded '{}' from the spec cache".format(spec_path))
+        with self._lock:
+            entry = self._entries.setdefault(digest, entry)
+            previous = self._digests.get(spec_path)
+            self._digests[spec_path] = digest
+            if previous not in (None, digest) and previous not in self._digests.values():
+                self._entries.pop(previous, None)
+        return entry
+
+    def header(self, spec_path, summarize):
+        """Return summarize(spec) of the given file, a small JSON value like
+        the target of a plan. It is cached apart from the spec, so that it is
+        known without loading the whole cache entry. summarize must always
+        return the same for the same spec."""
+        raw, digest = self._read(spec_path)
+        if digest not in self._headers:
+            header = self.cache.get(digest, ".header") if self.cache else None
+            if header is None:
+                header = summarize(self._load(spec_path, raw, digest)["spec"])
+                if self.cache: self.cache.put_header(digest, header)
+            self._headers[digest] = header
+        return self._headers[digest]
+
+    def release(self, spec_path):
+        """Drop the loaded spec of the given file from memory"""
+        with self._lock:
+            digest = self._digests.pop(spec_path, None)
+            if digest not in self._digests.values():
+                self._entries.pop(digest, None)
+
+    def resolved(self, digest, max_nodes):
+        """Return the cached RefResolver memo of a loaded spec, if any"""
+        return self._entries[digest]["resolved"].get(str(max_nodes))
+
+    def store_resolved(self, digest, max_nodes, memo):
+        entry = self._entries[digest]
+        # keyed by string as in JSON
+        if entry["resolved"].get(str(max_nodes)) is memo:
+            return
+        entry["resolved"][str(max_nodes)] = memo
+        if self.cache: self.cache.put(digest, entry)
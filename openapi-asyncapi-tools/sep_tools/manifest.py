@@ -0,0 +1,74 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+# keys set by Event Portal or derived from other objects, not part of the
+# content an object is synced from
+_DERIVED_KEYS = ("id", "applicationDomainId", "schemaId")
+
+def content_hash(payload, **extra):
+    """Stable hash of the content of an Event Portal object payload"""
+    content = {k: v for k, v in payload.items() if k not in _DERIVED_KEYS}
+    content.update(extra)
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+class Manifest:
+    """Ids and content hashes of every object of the last successful sync
+    of a spec, so that the next run only has to push what changed.
+
+    {
+        "domain": {"name": ..., "id": ...},
+        "application": {"name": ..., "id": ..., "pub": ..., "eventIds": [...]},
+        "schemas": {name: {"id": ..., "hash": ...}},
+        "events": {name: {"id": ..., "hash": ...}},
+    }
+
+    Without a path it is only kept in memory, e.g. between the syncs of
+    watch.Watcher.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except ValueError as e:
+                logging.warning("Ignoring invalid manifest '{}': {}".format(path, e))
+            else:
+                if data.get("version") == self.VERSION:
+                    self.data = data
+
+    def __str__(self):
+        return self.path or "<memory>"
+
+    def matches(self, domain, application):
+        """Whether the manifest was written for the given domain and application"""
+        return bool(self.data) and \
+            self.data["domain"]["name"] == domain and \
+            self.data["application"]["name"] == application
+
+    def get(self, section):
+        return self.data.get(section, {})
+
+    def save(self, domain, application, pub, schemas, events):
+        self.data = {
+            "version": self.VERSION,
+            "domain": domain,
+            "application": dict(application, pub=pub,
+                eventIds=sorted(v.id for v in events.values())),
+            "schemas": {k: {"id": v.id, "hash": v.hash} for k, v in schemas.items()},
+            "events": {k: {"id": v.id, "hash": v.hash} for k, v in events.items()},
+        }
+        if not self.path: return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+        logging.info("Manifest '{}' saved".format(self.path))
@@ -0,0 +1,131 @@
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+
+_EP_RE = re.compile(r'/api/v1/eventPortal/([^/]+)(/[^/]+)?(/.+)?$')
+_SEMP_RE = re.compile(r'/SEMP/v2/config/msgVpns/[^/]+(/.*)?$')
+
+def endpoint_of(url):
+    """Name the endpoint of a request url by its collection, with ids and
+    names replaced by placeholders, e.g. "schemas/{id}" or
+    "semp/queues/{name}/subscriptions" """
+    path = urlparse(url).path
+    m = _EP_RE.search(path)
+    if m:
+        coll, obj, rest = m.groups()
+        return coll + ("/{id}" if obj else "") + (rest or "")
+    m = _SEMP_RE.search(path)
+    if m:
+        parts = unquote(m.group(1) or "").strip("/").split("/")
+        # collections and names alternate: queues/<queue>/subscriptions/<topic>
+        return "/".join(["semp"] + [p if i % 2 == 0 else "{name}" for i, p in enumerate(parts) if p])
+    return path
+
+def percentile(values, p):
+    # nearest-rank percentile of sorted values
+    if not values: return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+class Metrics:
+    """Thread-safe recorder of every HTTP request and of the phases of a run"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = []
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def record(self, verb, url, status, seconds, retries=0, bytes_sent=0, bytes_received=0):
+        # status is None when the request failed without a response
+        with self._lock:
+            self.requests.append({
+                "verb": verb.upper(),
+                "endpoint": endpoint_of(url),
+                "status": status,
+                "seconds": seconds,
+                "retries": retries,
+                "bytes_sent": bytes_sent,
+                "bytes_received": bytes_received,
+            })
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append({"name": name, "seconds": time.perf_counter() - start})
+
+    def summary(self):
+        with self._lock:
+            requests = list(self.requests)
+            phases = list(self.phases)
+
+        endpoints = {}
+        for r in requests:
+            endpoints.setdefault(r["verb"]+" "+r["endpoint"], []).append(r)
+        by_endpoint = {}
+        for name, rs in sorted(endpoints.items()):
+            latencies = sorted(r["seconds"] for r in rs)
+            by_endpoint[name] = {
+                "count": len(rs),
+                "errors": sum(1 for r in rs if r["status"] is None or r["status"] >= 400),
+                "retries": sum(r["retries"] for r in rs),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "max": latencies[-1],
+                "total": sum(latencies),
+                "bytes_sent": sum(r["bytes_sent"] for r in rs),
+                "bytes_received": sum(r["bytes_received"] for r in rs),
+            }
+        return {
+            "seconds": time.perf_counter() - self.started,
+            "requests": len(requests),
+            "retries": sum(r["retries"] for r in requests),
+            "phases": phases,
+            "endpoints": by_endpoint,
+        }
+
+    def report(self, stream):
+        summary = self.summary()
+        stream.write("\nPhases:\n")
+        for p in summary["phases"]:
+            stream.write("  {:<20} {:>9.3f}s\n".format(p["name"], p["seconds"]))
+        stream.write("\n{:<48} {:>6} {:>6} {:>7} {:>9} {:>9} {:>9} {:>10} {:>10}\n".format(
+            "Endpoint", "count", "errors", "retries", "p50 ms", "p95 ms", "max ms", "sent", "received"))
+        for name, e in summary["endpoints"].items():
+            stream.write("{:<48} {:>6} {:>6} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>10} {:>10}\n".format(
+                name, e["count"], e["errors"], e["retries"], e["p50"]*1000, e["p95"]*1000,
+                e["max"]*1000, e["bytes_sent"], e["bytes_received"]))
+        stream.write("\n{} requests, {} retries in {:.3f}s\n".format(
+            summary["requests"], summary["retries"], summary["seconds"]))
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+_metrics = None
+
+def enable_metrics():
+    """Start recording the requests and phases of this run"""
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+def get_metrics():
+    # None unless enabled
+    return _metrics
+
+@contextmanager
+def phase(name):
+    """Time a phase of the run, a no-op unless metrics are enabled"""
+    if _metrics is None:
+        yield
+    else:
+        with _metrics.phase(name):
+            yield
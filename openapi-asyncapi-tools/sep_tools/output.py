@@ -0,0 +1,116 @@
+import contextlib
+import json
+import os
+import sys
+import tempfile
+
+FORMATS = ("json", "compact", "yaml")
+
+class StreamedMapping:
+    """A mapping of a document whose (key, value) pairs are produced lazily
+    while it is written, so that it never has to be held in memory"""
+
+    def __init__(self, items):
+        self.items = items
+
+@contextlib.contextmanager
+def open_output(path=None):
+    """The file to write to, stdout when path is None or '-'.
+
+    A file is written to a temporary file next to it, which only replaces
+    it once everything was written, so that a failure leaves the previous
+    content in place."""
+    if path in (None, "-"):
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix="."+name+".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            yield f
+        # mkstemp creates it private, keep the mode the file would have had
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        # e.g. SystemExit of a failed lookup
+        os.unlink(tmp)
+        raise
+
+class SpecWriter:
+    """Incremental JSON/YAML writer of OpenAPI and AsyncAPI documents.
+
+    Plain values are serialized as a whole, StreamedMapping values one
+    pair at a time. The JSON output is the same as json.dumps(document,
+    indent=2), compact the same as with separators=(",", ":")."""
+
+    def __init__(self, stream, fmt="json"):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown output format '{}'".format(fmt))
+        self.stream = stream
+        self.fmt = fmt
+
+    def write(self, document):
+        if self.fmt == "yaml":
+            self._write_yaml(document, 0)
+        else:
+            self._write_json(document, 0)
+            self.stream.write("\n")
+
+    # ------------------------------ JSON ------------------------------
+
+    def _write_json(self, value, level):
+        if isinstance(value, StreamedMapping):
+            self._write_json_mapping(value.items, level)
+        elif isinstance(value, dict) and self._has_stream(value):
+            self._write_json_mapping(value.items(), level)
+        elif self.fmt == "compact":
+            self.stream.write(json.dumps(value, separators=(",", ":")))
+        else:
+            text = json.dumps(value, indent=2)
+            self.stream.write(text.replace("\n", "\n"+"  "*level))
+
+    def _write_json_mapping(self, items, level):
+        compact = self.fmt == "compact"
+        indent = "" if compact else "\n"+"  "*(level+1)
+        first = True
+        self.stream.write("{")
+        for key, value in items:
+            self.stream.write(("" if first else ",")+indent+json.dumps(key)+(":" if compact else ": "))
+            self._write_json(value, level+1)
+            first = False
+        if not first and not compact:
+            self.stream.write("\n"+"  "*level)
+        self.stream.write("}")
+
+    # ------------------------------ YAML ------------------------------
+
+    def _write_yaml(self, value, level):
+        # PyYAML is only imported by the commands writing YAML
+        import yaml
+        items = value.items if isinstance(value, StreamedMapping) else value.items()
+        prefix = "  "*level
+        empty = True
+        for key, v in items:
+            empty = False
+            if isinstance(v, StreamedMapping) or (isinstance(v, dict) and self._has_stream(v)):
+                self.stream.write(prefix+yaml.safe_dump(key, explicit_end=False).splitlines()[0]+":\n")
+                if not self._write_yaml(v, level+1):
+                    # nothing was streamed, the mapping is empty
+                    self.stream.write(prefix+"  {}\n")
+            else:
+                text = yaml.safe_dump({key: v}, default_flow_style=False, sort_keys=False,
+                    allow_unicode=True)
+                self.stream.write("".join(prefix+line for line in text.splitlines(True)))
+        return not empty
+
+    @staticmethod
+    def _has_stream(mapping):
+        return any(isinstance(v, StreamedMapping) or (isinstance(v, dict) and SpecWriter._has_stream(v)) \
+            for v in mapping.values())
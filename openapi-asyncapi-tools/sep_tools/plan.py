@@ -0,0 +1,253 @@
+import hashlib
+import json
+import logging
+import re
+
+from .manifest import content_hash
+from .metrics import phase
+from .resolver import RefResolver
+from .util import HTTP_METHODS
+
+PLAN_KIND = "sep-plan"
+PLAN_VERSION = 1
+
+# target of a spec without any given domain or application
+DEFAULT_DOMAIN = "TestDomain"
+DEFAULT_APPLICATION = "TestApp"
+
+class Planner:
+    """Turn an OpenAPI spec into a plan of the Event Portal objects and
+    queue subscriptions it stands for, without any network call.
+
+    The plan is a plain JSON document:
+
+    {
+        "kind": "sep-plan",
+        "version": 1,
+        "spec": {"path": ..., "digest": ...},
+        "domain": {"name": ..., "payload": {...}},
+        "application": {"name": ..., "pub": ..., "payload": {...}},
+        "schemas": {name: {"payload": {...}, "hash": ..., "inline": ...}},
+        "events": {name: {"schemaName": ..., "payload": {...}, "hash": ...}},
+        "subscriptions": [topic, ...],
+    }
+    """
+
+    _refSchemaRe = re.compile(r'\#\/components\/schemas/([^\/]+)$')
+    _paraRe = re.compile("{[^}]+}")
+
+    def __init__(self, spec, max_ref_nodes=2000, memo=None):
+        self.spec = spec
+        self.resolver = RefResolver(spec, max_ref_nodes, memo)
+        self.Schemas = {}
+        self.Events = {}
+
+    def plan(self, domain=None, application=None, pub=False):
+        self.generate_ep_objects()
+        return {
+            "kind": PLAN_KIND,
+            "version": PLAN_VERSION,
+            "domain": {
+                "name": domain,
+                "payload": {
+                    "name": domain,
+                    "enforceUniqueTopicNames": True,
+                    "topicDomain": "",
+                },
+            },
+            "application": {
+                "name": application,
+                "pub": pub,
+                "payload": {
+                    "name": application,
+                },
+            },
+            "schemas": self.Schemas,
+            "events": self.Events,
+            "subscriptions": self.queue_subscriptions(),
+        }
+
+    def generate_ep_objects(self):
+        for path, path_item in self.spec["paths"].items():
+            for method in HTTP_METHODS:
+                if method not in path_item: continue
+                operation = path_item.get(method)
+                operationId = operation.get("operationId")
+                event = {
+                    "schemaName": None,
+                    "payload": {
+                        "name": operationId,
+                        "description": operation.get("description", ""),
+                        "topicName": method.upper()+path,
+                    }
+                }
+
+                schemaName = self._extract_schema_from_operation(operation)
+                if schemaName : event["schemaName"]=schemaName
+                event["hash"] = content_hash(event["payload"], schemaName=schemaName)
+                self.Events[operationId]=event
+
+    def _extract_schema_from_operation(self, operation):
+        schemaName = None
+        requestBody = operation.get("requestBody", {'content':{}})
+        if requestBody.get("$ref"):
+            # Reference Object like #/components/requestBodies/Coupon
+            requestBody = self.resolver.lookup(requestBody.get("$ref"))
+        content = requestBody.get("content", {})
+        jsonkeys = [k for k in content.keys() if k.startswith("application/json")]
+        if len(jsonkeys) > 0:
+            # only extract the first matched json schema
+            schema = content.get(jsonkeys[0]).get("schema") or {}
+            if schema.get("$ref") and self._refSchemaRe.search(schema.get("$ref")):
+                # Reference Object like #/components/schemas/CouponRequest
+                schemaName = self._refSchemaRe.search(schema.get("$ref")).group(1)
+                if not self.Schemas.get(schemaName): 
+                    self._add_schema(schemaName, self._get_component_schema(schemaName))
+            else:
+                # Inline Schema Object
+                schemaName = operation.get("operationId")+"_schema"
+                self._add_schema(schemaName, self.resolver.expand(schema), inline=True)
+        return schemaName
+
+    def _add_schema(self, schemaName, schema, inline=False):
+        # inline tells a schema of a request body from a named component
+        payload = {
+            "contentType": "JSON",
+            "content": json.dumps(schema),
+            "name": schemaName,
+        }
+        self.Schemas[schemaName] = {"payload": payload, "hash": content_hash(payload),
+            "inline": inline}
+
+    def _get_component_schema(self, schemaName):
+        # Event Portal doesn't support reference inside schema, so all
+        # of them are expanded into an integrated schema
+        ref = "#/components/schemas/"+schemaName
+        size = self.resolver.size_of(ref)
+        logging.info("Schema '{}' expanded to {} nodes, {} bytes".format(
+            schemaName, size["nodes"], size["bytes"]))
+        return self.resolver.resolve(ref)
+
+    def queue_subscriptions(self):
+        # one wildcard subscription per distinct event topic, path
+        # parameters like {id} match any single level
+        topics = [self._paraRe.sub("*", v["payload"]["topicName"]) for v in self.Events.values()]
+        return list(dict.fromkeys(topics))
+
+def canonical_digest(schema):
+    """Hash of a schema which doesn't depend on the order of its keys, nor
+    on the order of its required properties"""
+    def canonical(node):
+        if isinstance(node, dict):
+            return {k: sorted(v) if k == "required" and isinstance(v, list) and \
+                all(isinstance(x, str) for x in v) else canonical(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [canonical(v) for v in node]
+        return node
+    return hashlib.sha256(json.dumps(canonical(schema), sort_keys=True).encode()).hexdigest()
+
+def dedupe_schemas(plan):
+    """Map the schemas of identical content to one shared schema, which every
+    matching event references. Named component schemas are kept over the
+    <operationId>_schema ones of inline request bodies."""
+    groups = {}
+    for name, schema in plan["schemas"].items():
+        content = json.loads(schema["payload"]["content"])
+        key = (schema["payload"]["contentType"], canonical_digest(content))
+        groups.setdefault(key, []).append(name)
+
+    aliases = {}
+    saved_bytes = 0
+    # plans written before schemas were flagged hold none inline
+    inline = lambda name: plan["schemas"][name].get("inline", False)
+    for names in groups.values():
+        if len(names) == 1: continue
+        shared = min(names, key=lambda name: (inline(name), names.index(name)))
+        for name in names:
+            if name == shared: continue
+            aliases[name] = shared
+            saved_bytes += len(plan["schemas"][name]["payload"]["content"])
+
+    for name in aliases:
+        del plan["schemas"][name]
+    for event in plan["events"].values():
+        if event.get("schemaName") in aliases:
+            event["schemaName"] = aliases[event["schemaName"]]
+            event["hash"] = content_hash(event["payload"], schemaName=event["schemaName"])
+
+    report = {
+        "schemas": len(plan["schemas"]) + len(aliases),
+        "shared": len(plan["schemas"]),
+        "aliases": aliases,
+        "bytesSaved": saved_bytes,
+    }
+    plan["dedupe"] = report
+    # every schema costs a lookup and a POST on a first import
+    logging.info("Deduplicated {} schemas into {}: {} schema objects, up to {} requests "
+        "and {} bytes of content saved".format(report["schemas"], report["shared"],
+        len(aliases), 2*len(aliases), saved_bytes))
+    return report
+
+def is_plan(doc):
+    return isinstance(doc, dict) and doc.get("kind") == PLAN_KIND
+
+def target_domain(loader, spec_path):
+    """Domain a spec or plan file goes to without any given one"""
+    try:
+        header = loader.header(spec_path, _plan_header)
+    except Exception:
+        # reported by its import
+        return DEFAULT_DOMAIN
+    return header["domain"] or DEFAULT_DOMAIN
+
+def _plan_header(doc):
+    return {"domain": doc["domain"]["name"] if is_plan(doc) else None}
+
+def plan_spec(loader, spec_path, domain=None, application=None, pub=None, max_ref_nodes=2000,
+    dedupe=False, default_application=DEFAULT_APPLICATION):
+    """Return the plan of an OpenAPI spec file. A file that already holds a
+    plan, like the output of `sep plan`, is used as is, only moved to the
+    given domain, application and pub flag if any. A spec goes to the given
+    ones, by default DEFAULT_DOMAIN, default_application and subscribe.
+    With dedupe, identical schemas are shared, see dedupe_schemas."""
+    with phase("parse"):
+        doc, digest = loader.load(spec_path)
+    if is_plan(doc):
+        if doc.get("version") != PLAN_VERSION:
+            logging.error("The plan version of '{}' is {}, must be {}.".format(
+                spec_path, doc.get("version"), PLAN_VERSION))
+            raise SystemExit(1)
+        plan = retarget(doc, domain, application, pub)
+        if dedupe: dedupe_schemas(plan)
+        return plan
+
+    version = doc.get("openapi")
+    if not version:
+        logging.error("There is no 'openapi' filed in {}".format(spec_path))
+        raise SystemExit(1)
+
+    if int(version.split(".")[0]) < 3:
+        logging.error("The open api version of '{}' is {}, must be 3.x.".format(spec_path, version))
+        raise SystemExit(1)
+
+    with phase("resolve"):
+        planner = Planner(doc, max_ref_nodes, loader.resolved(digest, max_ref_nodes))
+        plan = planner.plan(domain or DEFAULT_DOMAIN, application or default_application, bool(pub))
+        loader.store_resolved(digest, max_ref_nodes, planner.resolver.memo)
+    plan["spec"] = {"path": spec_path, "digest": digest}
+    if dedupe: dedupe_schemas(plan)
+    return plan
+
+def retarget(plan, domain=None, application=None, pub=None):
+    if domain:
+        plan["domain"]["name"] = plan["domain"]["payload"]["name"] = domain
+    if application:
+        plan["application"]["name"] = plan["application"]["payload"]["name"] = application
+    if pub is not None:
+        plan["application"]["pub"] = pub
+    return plan
+
+def write_plan(plan, stream):
+    # sorted keys keep plans of the same spec diffable
+    json.dump(plan, stream, indent=2, sort_keys=True)
+    stream.write("\n")
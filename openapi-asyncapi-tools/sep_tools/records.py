@@ -0,0 +1,70 @@
+class Record:
+    """An Event Portal object of an import.
+
+    It holds the id, the content hash and the fields of the object in slots,
+    the JSON payload is only built from them when the object is sent."""
+
+    __slots__ = ("name", "id", "hash", "changed")
+    # fields of the payload
+    FIELDS = ("name",)
+    # fields sent as null by an update when they are None, to clear them
+    NULLABLE = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._all_slots = tuple(slot for klass in reversed(cls.__mro__) \
+            for slot in klass.__dict__.get("__slots__", ()))
+
+    def __init__(self, name, **fields):
+        for slot in self._all_slots:
+            setattr(self, slot, None)
+        self.name = name
+        self.changed = False
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def from_plan(cls, name, planned):
+        """Build the record of a plan entry, see plan.Planner"""
+        obj = cls(name, **{k: v for k, v in planned["payload"].items() \
+            if k in cls.FIELDS and k != "name"})
+        obj.hash = planned.get("hash")
+        return obj
+
+    def payload(self, update=False):
+        return {field: getattr(self, field) for field in self.FIELDS \
+            if getattr(self, field) is not None or (update and field in self.NULLABLE)}
+
+    def __repr__(self):
+        return "{}({!r}, id={!r})".format(type(self).__name__, self.name, self.id)
+
+class ApplicationDomain(Record):
+    __slots__ = ("enforceUniqueTopicNames", "topicDomain")
+    FIELDS = ("name", "enforceUniqueTopicNames", "topicDomain")
+
+class Application(Record):
+    __slots__ = ("applicationDomainId",)
+    FIELDS = ("name", "applicationDomainId")
+
+class Schema(Record):
+    __slots__ = ("contentType", "content", "applicationDomainId")
+    FIELDS = ("name", "contentType", "content", "applicationDomainId")
+
+# remoteSchemaId of an event which wasn't compared with Event Portal
+UNKNOWN = object()
+
+class Event(Record):
+    # remoteSchemaId is the schema id an existing event has in Event Portal
+    __slots__ = ("description", "topicName", "applicationDomainId", "schemaId",
+        "schemaName", "remoteSchemaId")
+    FIELDS = ("name", "description", "topicName", "applicationDomainId", "schemaId")
+    NULLABLE = ("schemaId",)
+
+    def __init__(self, name, **fields):
+        super().__init__(name, **dict({"remoteSchemaId": UNKNOWN}, **fields))
+
+    @classmethod
+    def from_plan(cls, name, planned):
+        obj = super().from_plan(name, planned)
+        obj.schemaName = planned.get("schemaName")
+        return obj
@@ -0,0 +1,246 @@
+import json
+import logging
+from urllib.parse import unquote
+
+def _refs_of(node):
+    """References found in node, in document order"""
+    refs, stack = {}, [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if isinstance(ref, str):
+                refs[ref] = None
+                continue
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return list(refs)
+
+class RefResolver:
+    """Expand local Reference Objects ("$ref": "#/...") of an OpenAPI spec,
+    since Event Portal doesn't support references inside schemas.
+
+    The components are first grouped into the strongly connected components
+    of their references (Tarjan), the members of a group reference each
+    other in a cycle. They are ordered by their reference, and as nested
+    into each other only the references to later members are expanded, a
+    reference back to the same or an earlier member is replaced by an
+    annotated stub. The component given to resolve() expands every other
+    member of its group. None of this depends on where a component is
+    reached from, so every component is expanded once and memoized, and it
+    resolves the same whatever was resolved before it.
+
+    A nested reference whose expansion has more than max_nodes nodes is
+    replaced by an annotated stub too, which bounds the size of specs like
+    stripe's where most objects expand into each other. Lists (allOf, oneOf,
+    items, ...) are walked as well and the source spec is never mutated.
+    Nothing recurses, so long chains of references don't overflow the stack.
+    Expanded values are shared between all places that reference the same
+    component, so treat them as read-only.
+    """
+
+    def __init__(self, spec, max_nodes=2000, memo=None):
+        self.spec = spec
+        self.max_nodes = max_nodes
+        # ref -> (expanded value, number of nodes) as given to resolve(),
+        # may come from a cache
+        self.memo = memo if memo is not None else {}
+        # ref -> (expanded value, number of nodes) as nested into the other
+        # members of its group
+        self._nested = {}
+        # ref -> raw target, and the references found in it
+        self._targets = {}
+        self._edges = {}
+        # ref -> index of its group, a group only references itself and
+        # groups of a lower index, and ref -> its rank in its group
+        self._group = {}
+        self._rank = {}
+        self._members = []
+        self._expanded = set()
+        # description -> stub
+        self._stubs = {}
+        # ref -> {"nodes": ..., "bytes": ...} for every resolved component
+        self.sizes = {}
+
+    def resolve(self, ref):
+        """Return the expanded target of a local reference"""
+        value, _ = self._resolved(ref)
+        return value
+
+    def expand(self, node):
+        """Return a copy of node with all local references expanded"""
+        for ref in _refs_of(node):
+            self._resolved(ref)
+        value, _ = self._walk(node, self.memo.__getitem__)
+        return value
+
+    def size_of(self, ref):
+        """Nodes and serialized bytes of the expansion of a reference"""
+        if ref not in self.sizes:
+            value, nodes = self._resolved(ref)
+            self.sizes[ref] = {
+                "nodes": nodes,
+                "bytes": len(json.dumps(value)),
+            }
+        return self.sizes[ref]
+
+    def lookup(self, ref):
+        """Return the raw (unexpanded) target of a local reference"""
+        if not ref.startswith("#"):
+            raise KeyError(ref)
+        node = self.spec
+        for token in ref[1:].split("/")[1:]:
+            token = unquote(token).replace("~1", "/").replace("~0", "~")
+            if isinstance(node, list):
+                node = node[int(token)]
+            else:
+                node = node[token]
+        return node
+
+    def _resolved(self, ref):
+        # (value, number of nodes) of the memoized expansion of ref
+        if ref not in self.memo:
+            self._group_from(ref)
+            # the groups ref reaches which are not expanded yet, from the
+            # ones that reference no other
+            groups, todo = set(), [self._group[ref]]
+            while todo:
+                group = todo.pop()
+                if group in groups or group in self._expanded: continue
+                groups.add(group)
+                todo.extend(self._group[t] for m in self._members[group] for t in self._edges[m])
+            for group in sorted(groups):
+                self._expand_group(group)
+            self._memoize(ref)
+        value, size = self.memo[ref]
+        return value, size
+
+    def _expand_group(self, group):
+        members = self._members[group]
+        for member in members:
+            for target in self._edges[member]:
+                if self._group[target] != group: self._memoize(target)
+        # the later members first, the earlier ones nest them
+        for member in reversed(members):
+            if member in self._targets:
+                self._nested[member] = self._walk(self._targets[member],
+                    lambda ref, member=member: self._expanded_ref(ref, member, nested=True))
+        self._expanded.add(group)
+
+    def _memoize(self, ref):
+        # the groups it reaches must be expanded
+        if ref not in self.memo:
+            self.memo[ref] = self._walk(self._targets[ref],
+                lambda target: self._expanded_ref(target, ref, nested=False))
+
+    def _expanded_ref(self, ref, owner, nested):
+        # (value, number of nodes) of a reference found in the target of
+        # owner, either as given to resolve() or as nested into its group
+        if self._group[ref] != self._group[owner]:
+            return self.memo[ref]
+        if ref == owner or (nested and self._rank[ref] < self._rank[owner]):
+            return self._stub(ref, "Circular reference to '{}', not expanded".format(ref)), 1
+        return self._nested[ref]
+
+    def _edges_of(self, ref):
+        if ref not in self._edges:
+            try:
+                self._targets[ref] = self.lookup(ref)
+                self._edges[ref] = _refs_of(self._targets[ref])
+            except (KeyError, IndexError, ValueError, TypeError):
+                logging.warning("Could not resolve reference '{}', kept as is".format(ref))
+                self._edges[ref] = []
+                self.memo[ref] = self._nested[ref] = ({"$ref": ref}, 1)
+        return self._edges[ref]
+
+    def _group_from(self, start):
+        # iterative Tarjan over the references reachable from start which
+        # are not grouped yet
+        if start in self._group:
+            return
+        index, low, stack, on_stack = {start: 0}, {start: 0}, [start], {start}
+        work = [(start, iter(self._edges_of(start)))]
+        while work:
+            ref, edges = work[-1]
+            for target in edges:
+                if target in self._group:
+                    continue
+                if target not in index:
+                    index[target] = low[target] = len(index)
+                    stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, iter(self._edges_of(target))))
+                    break
+                if target in on_stack:
+                    low[ref] = min(low[ref], index[target])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[ref])
+                if low[ref] == index[ref]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        members.append(member)
+                        if member == ref: break
+                    members.sort()
+                    for rank, member in enumerate(members):
+                        self._group[member] = len(self._members)
+                        self._rank[member] = rank
+                    self._members.append(members)
+
+    def _walk(self, node, expanded):
+        # copy node, with every reference replaced by expanded(ref). A
+        # frame is [items, value, number of nodes, key of the pending child]
+        max_nodes = self.max_nodes
+        root = [iter(((None, node),)), [], 0, None]
+        stack = [root]
+        while True:
+            frame = stack[-1]
+            value = frame[1]
+            for key, child in frame[0]:
+                if type(child) is dict:
+                    ref = child.get("$ref")
+                    if type(ref) is not str:
+                        frame[3] = key
+                        stack.append([iter(child.items()), {}, 1, None])
+                        break
+                    child, size = expanded(ref)
+                    if max_nodes and size > max_nodes:
+                        child, size = self._stub(ref, "Reference to '{}' expands to {} nodes, "\
+                            "not expanded".format(ref, size)), 1
+                elif type(child) is list:
+                    frame[3] = key
+                    stack.append([enumerate(child), [], 1, None])
+                    break
+                else:
+                    size = 1
+                if type(value) is list:
+                    value.append(child)
+                else:
+                    value[key] = child
+                frame[2] += size
+            else:
+                # the frame is complete, hand its value to the parent
+                stack.pop()
+                if frame is root:
+                    return value[0], frame[2]
+                parent = stack[-1]
+                if type(parent[1]) is list:
+                    parent[1].append(value)
+                else:
+                    parent[1][parent[3]] = value
+                parent[2] += frame[2]
+
+    def _stub(self, ref, description):
+        # stubs are shared like the expanded values
+        stub = self._stubs.get(description)
+        if stub is None:
+            stub = self._stubs[description] = {"description": description}
+            target = self._targets.get(ref)
+            if isinstance(target, dict) and "type" in target:
+                stub["type"] = target["type"]
+        return stub
@@ -0,0 +1,169 @@
+import logging
+from collections import defaultdict
+
+from .util import HTTP_METHODS
+
+# the first level of an event topic is its HTTP method
+METHODS = frozenset(m.upper() for m in HTTP_METHODS)
+
+def split_topic(topic):
+    return tuple(topic.split("/"))
+
+def join_topic(levels):
+    return "/".join(levels)
+
+def matches(pattern, topic):
+    """Whether a subscription matches a topic, both as tuples of levels.
+    '*' matches exactly one level, a trailing '>' one or more levels."""
+    for i, level in enumerate(pattern):
+        if level == ">" and i == len(pattern)-1:
+            return len(topic) > i
+        if i >= len(topic) or (level != "*" and level != topic[i]):
+            return False
+    return len(pattern) == len(topic)
+
+def subsumes(pattern, sub):
+    """Whether every topic matched by sub is matched by pattern as well"""
+    if pattern[-1] == ">":
+        prefix = pattern[:-1]
+        if len(sub) <= len(prefix): return False
+    else:
+        prefix = pattern
+        if len(sub) != len(pattern): return False
+    for p, s in zip(prefix, sub):
+        if s == ">" or (p != "*" and p != s):
+            return False
+    return True
+
+class TopicMinimizer:
+    """Collapse topic subscriptions into Solace wildcards.
+
+    Subscriptions that differ in a single level are merged into one with
+    '*' at that level. A merge also matches topics none of the original
+    subscriptions did. At the method level these are the topics with the
+    other HTTP methods: merging GET/v1/customers/* and POST/v1/customers/*
+    additionally matches DELETE/v1/customers/* and 5 more. A merge is only
+    done when it adds at most max_extra such topics.
+
+    A '*' replacing a path level, unlike one of a path parameter, matches
+    any value there, so it is never merged. Neither is 'prefix/>', which
+    matches any topic below the prefix, unless multi_level allows merging
+    subscriptions sharing a prefix of at least min_prefix levels into it.
+    The known topics below the prefix it adds count against max_extra too,
+    the unknown ones it matches as well can't be counted.
+    """
+
+    def __init__(self, topics, max_extra=0, multi_level=False, min_prefix=2):
+        self.topics = list(dict.fromkeys(split_topic(t) for t in topics))
+        self.max_extra = max_extra
+        self.multi_level = multi_level
+        self.min_prefix = min_prefix
+        self.neighbours = self._neighbours()
+        # (position, level) -> neighbours having that level there
+        self._index = defaultdict(set)
+        for n in self.neighbours:
+            for i, level in enumerate(n):
+                self._index[(i, level)].add(n)
+        self._matching = {}
+        # merges done: (pattern, replaced subscriptions, extra known topics),
+        # a 'prefix/>' pattern matches unknown topics as well
+        self.merges = []
+
+    def _neighbours(self):
+        vocab = defaultdict(set)
+        for t in self.topics:
+            for i, level in enumerate(t):
+                vocab[(len(t), i)].add(level)
+            if t[0] in METHODS:
+                vocab[(len(t), 0)] |= METHODS
+        known = set(self.topics)
+        neighbours = set()
+        for t in self.topics:
+            for i in range(len(t)):
+                for level in vocab[(len(t), i)]:
+                    n = t[:i]+(level,)+t[i+1:]
+                    if n not in known: neighbours.add(n)
+        return neighbours
+
+    def matching(self, pattern):
+        """The neighbour topics matched by a subscription"""
+        if pattern not in self._matching:
+            prefix = pattern[:-1] if pattern[-1] == ">" else pattern
+            sets = [self._index.get((i, level), set()) \
+                for i, level in enumerate(prefix) if level != "*"]
+            sets.sort(key=len)
+            found = set.intersection(*sets) if sets else self.neighbours
+            self._matching[pattern] = {n for n in found if matches(pattern, n)}
+        return self._matching[pattern]
+
+    @staticmethod
+    def _unbounded(pattern, covered):
+        # whether the merge matches topics no known value limits
+        if pattern[-1] == ">": return True
+        for i, level in enumerate(pattern):
+            if level != "*" or all(s[i] == "*" for s in covered): continue
+            if i > 0 or any(s[0] not in METHODS and s[0] != "*" for s in covered):
+                return True
+        return False
+
+    def _candidates(self, subs):
+        # pattern -> the subscriptions it would replace
+        groups = defaultdict(set)
+        for s in subs:
+            if s[-1] == ">": continue
+            for i in range(len(s)):
+                groups[s[:i]+("*",)+s[i+1:]].add(s)
+        if self.multi_level:
+            for s in subs:
+                for k in range(self.min_prefix, len(s)):
+                    groups[s[:k]+(">",)].add(s)
+        return groups
+
+    def minimize(self):
+        """Return the minimized list of subscriptions"""
+        subs = set(self.topics)
+        # neighbours already matched by the current subscriptions
+        matched = set()
+        for s in subs:
+            if "*" in s or s[-1] == ">": matched |= self.matching(s)
+
+        while True:
+            best = None
+            for pattern, covered in self._candidates(subs).items():
+                gain = len(covered)-1
+                if gain < 1 or (best and gain < best[0]): continue
+                if pattern in subs:
+                    # only drops the subscriptions it already matches
+                    extras = set()
+                else:
+                    if self._unbounded(pattern, covered) and \
+                        not (self.multi_level and pattern[-1] == ">"): continue
+                    extras = self.matching(pattern) - matched
+                    if len(extras) > self.max_extra: continue
+                key = (gain, -len(extras), pattern[-1] != ">", len(pattern))
+                if not best or key > best[:4]:
+                    best = key+(pattern, covered, extras)
+            if not best: break
+            pattern, covered, extras = best[4:]
+            # drop everything the new subscription makes redundant
+            covered = {s for s in subs if subsumes(pattern, s)}
+            subs -= covered
+            subs.add(pattern)
+            matched |= self.matching(pattern)
+            self.merges.append((pattern, sorted(covered), sorted(extras)))
+        return sorted(join_topic(s) for s in subs)
+
+def minimize_subscriptions(topics, max_extra=0, multi_level=False):
+    """Minimize topic subscriptions and log what each merge costs"""
+    minimizer = TopicMinimizer(topics, max_extra, multi_level)
+    subs = minimizer.minimize()
+    for pattern, covered, extras in minimizer.merges:
+        also = ""
+        if extras:
+            also = ", also matching {}".format(", ".join(join_topic(e) for e in extras))
+        if pattern[-1] == ">":
+            also += "{} any topic below '{}'".format(" and" if extras else ", also matching",
+                join_topic(pattern[:-1]))
+        logging.info("'{}' replaces {} subscriptions{}".format(join_topic(pattern), len(covered), also))
+    logging.info("Subscriptions minimized from {} to {}".format(len(minimizer.topics), len(subs)))
+    return subs
@@ -1,6 +1,11 @@
 import json
-import requests
 import logging
+import sys
+import threading
+import time
+
+from .metrics import get_metrics
+from .output import SpecWriter, StreamedMapping
 
 HTTP_METHODS = [
     'get', 
@@ -12,31 +17,230 @@ HTTP_METHODS = [
     'patch', 
     'trace']
 
-def rest(verb, url, data_json=None, expected_code=200, params=None, token=None):
+class HttpClient:
+    """A pooled, keep-alive HTTP client shared by all Event Portal and SEMP calls.
+
+    Connections are reused per host, so a whole run pays for one TLS handshake
+    per host instead of one per request. Responses with status 429 are retried
+    for every verb, 5xx responses and connection errors only for idempotent
+    verbs, with exponential backoff (or the server's Retry-After). A 429 also
+    holds back every other request of the client for the same delay,
+    rate_limit caps the number of requests per second and max_in_flight the
+    number of concurrent requests over all threads (0 for no cap)."""
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ('get', 'put', 'delete', 'options', 'head', 'trace')
+
+    def __init__(self, pool_size=10, timeout=30, retries=3, backoff=0.5, rate_limit=0,
+        max_in_flight=0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limit = rate_limit
+        self._next_slot = 0
+        self._slot_lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        # requests is only imported once a command talks to a server
+        import requests
+        self.session = requests.Session()
+        self.pool_size = 0
+        self.grow_pool(pool_size)
+
+    def grow_pool(self, pool_size):
+        """Keep at least pool_size connections per host, so that no thread
+        of a command has to open a connection the pool can't take back"""
+        from requests.adapters import HTTPAdapter
+        with self._slot_lock:
+            if pool_size <= self.pool_size: return
+            self.pool_size = pool_size
+            adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=0)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+
+    def request(self, verb, url, **kwargs):
+        import requests
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            self._throttle()
+            try:
+                r = self._send(verb, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries or verb not in self.IDEMPOTENT_METHODS:
+                    self._record(verb, url, None, start, attempt, kwargs)
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                reason = type(e).__name__
+            else:
+                if attempt >= self.retries or not self._should_retry(verb, r.status_code):
+                    self._record(verb, url, r, start, attempt, kwargs)
+                    return r
+                delay = self._retry_after(r)
+                if delay is None: delay = self.backoff * (2 ** attempt)
+                reason = r.status_code
+                if r.status_code == 429: self._hold(delay)
+            attempt += 1
+            logging.warning("{} on {} failed ({}), retry {}/{} in {:.1f}s".format(
+                verb.upper(), url, reason, attempt, self.retries, delay))
+            time.sleep(delay)
+
+    def _send(self, verb, url, **kwargs):
+        if self._in_flight is None:
+            return self.session.request(verb.upper(), url, **kwargs)
+        with self._in_flight:
+            return self.session.request(verb.upper(), url, **kwargs)
+
+    @staticmethod
+    def _record(verb, url, r, start, retries, kwargs):
+        metrics = get_metrics()
+        if metrics is None: return
+        # latency includes the retries and their backoff
+        metrics.record(verb, url, r.status_code if r is not None else None,
+            time.perf_counter() - start, retries,
+            len(kwargs.get("data") or ""), len(r.content) if r is not None else 0)
+
+    def _throttle(self):
+        # wait for the next free request slot
+        with self._slot_lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            if self.rate_limit:
+                self._next_slot = max(now, self._next_slot) + 1.0/self.rate_limit
+        if delay > 0: time.sleep(delay)
+
+    def _hold(self, delay):
+        with self._slot_lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + delay)
+
+    def _should_retry(self, verb, status_code):
+        if status_code == 429:
+            return True
+        return status_code in self.RETRY_STATUS and verb in self.IDEMPOTENT_METHODS
+
+    @staticmethod
+    def _retry_after(r):
+        try:
+            return float(r.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_options = {}
+_client_lock = threading.Lock()
+
+def configure_client(**kwargs):
+    """Replace the shared client, e.g. with another pool size or timeout.
+    It is created by the first get_client()."""
+    global _client, _client_options
+    with _client_lock:
+        if _client: _client.close()
+        _client = None
+        _client_options = kwargs
+
+def get_client(min_pool_size=0):
+    """Return the shared client, with a pool of at least min_pool_size
+    connections per host, e.g. the number of threads of the caller"""
+    global _client
+    with _client_lock:
+        if not _client: _client = HttpClient(**_client_options)
+    _client.grow_pool(min_pool_size)
+    return _client
+
+class RestError(SystemExit):
+    """Unexpected status of an Event Portal call, a SystemExit with status 1
+    unless caught"""
+
+    def __init__(self, verb, url, status_code, text, payload=None):
+        super().__init__(1)
+        self.verb = verb
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.payload = payload
+
+    def __str__(self):
+        return "{} on {} returns {}".format(self.verb.upper(), self.url, self.status_code)
+
+    def details(self):
+        """The error with the request payload and the response body"""
+        lines = [str(self)]
+        if self.payload: lines.append(json.dumps(self.payload, indent=2))
+        lines.append(self.text)
+        return "\n".join(lines)
+
+def rest(verb, url, data_json=None, expected_code=200, params=None, token=None, client=None,
+    cache=None):
+    # GETs go through the HttpCache if any, see httpcache.HttpCache
     headers={"content-type": "application/json"}
     if token : headers["Authorization"] = "Bearer "+token
+    entry = None
+    if cache is not None and verb == "get":
+        key = cache.key(url, params, token)
+        entry = cache.load(key)
+        validators = cache.validators(entry) if entry else {}
+        if entry and not validators and cache.fresh(entry):
+            cache.count("hits")
+            return json.loads(entry["body"]) if entry["body"] else None
+        headers.update(validators)
     str_json = json.dumps(data_json) if data_json != None else None
-    r = getattr(requests, verb)(url, headers=headers,
+    r = (client or get_client()).request(verb, url, headers=headers,
         data=(str_json), params=params)
+    if entry and r.status_code == 304:
+        cache.count("revalidated")
+        cache.touch(key, entry)
+        return json.loads(entry["body"]) if entry["body"] else None
     if (r.status_code != expected_code):
-        logging.error("{} on {} returns {}".format(verb.upper(), url, r.status_code))
-        if data_json: print(json.dumps(data_json, indent=2))
-        print(r.text)
-        raise SystemExit
+        error = RestError(verb, url, r.status_code, r.text, data_json)
+        # one record, so that the failures of concurrent calls don't interleave
+        logging.error(error.details())
+        raise error
+
+    if cache is not None and verb == "get":
+        cache.count("misses")
+        cache.store(key, r)
+    # e.g. 204 No Content of a DELETE
+    return r.json() if r.content else None
 
-    return r.json()
+class SempError(RuntimeError):
+    """Unexpected status of a SEMP v2 call"""
 
-def sempv2(verb, url, admin_user, admin_password, data_json=None):
+    def __init__(self, verb, url, status_code, text, payload=None):
+        super().__init__("{} on {} returns {}".format(verb.upper(), url, status_code))
+        self.status_code = status_code
+        self.text = text
+        self.payload = payload
+        try:
+            self.semp_status = safeget(json.loads(text), "meta", "error", "status")
+        except ValueError:
+            self.semp_status = None
+
+    def details(self):
+        """The error with the request payload and the response body"""
+        lines = [str(self)]
+        if self.payload: lines.append(json.dumps(self.payload, indent=2))
+        lines.append(self.text)
+        return "\n".join(lines)
+
+def sempv2(verb, url, admin_user, admin_password, data_json=None, client=None,
+    params=None, ignore=()):
+    # errors whose SEMP status (like NOT_FOUND or ALREADY_EXISTS) is
+    # in ignore are expected by the caller, None is returned for them
     headers={"content-type": "application/json"}
     str_json = json.dumps(data_json,indent=2) if data_json != None else None
-    r = getattr(requests, verb)(url, headers=headers,
+    r = (client or get_client()).request(verb, url, headers=headers,
         auth=(admin_user, admin_password),
-        data=(str_json))
+        data=(str_json), params=params)
     if r.status_code != 200:
-        print("{} on {} returns {}".format(verb.upper(), url, r.status_code))
-        if str_json: print(str_json)
-        print(r.text)
-        raise RuntimeError
+        error = SempError(verb, url, r.status_code, r.text, data_json)
+        if error.semp_status in ignore:
+            return None
+        # one record on stderr like rest(), stdout is left to the command output
+        logging.error(error.details())
+        raise error
     else:
         return r.json()
 
@@ -49,29 +253,15 @@ def safeget(dct, *keys):
     return dct
 
 
-def generateOpenAPISpec(app_name, description, event_list, schema_list):
-    # 1. init the spec
-    spec = {
-        "openapi": "3.0.0",
-        "info": {
-            "title": app_name,
-            "description": description if description else "",
-            "version": "1.0.0"
-        },
-        "components": {
-            "schemas": {}
-        },
-        "paths": {}
-    }
-    
-    # 2. generate all schemas
-    schemas = spec["components"]["schemas"]
-    for es in schema_list:
-        if es["contentType"]=="JSON" and es["content"]:
-            # only support JSON schema ("JSON","XML","Text","Binary")
-            schemas[es["name"]] = json.loads(es["content"])
-
-    # 3. generate all path
+def generateOpenAPISpec(app_name, description, event_list, schema_list, writer=None):
+    # 1. index all schemas, only support JSON schema ("JSON","XML","Text","Binary")
+    json_schemas = {es["name"]: es for es in schema_list \
+        if es["contentType"]=="JSON" and es["content"]}
+    schemas_by_id = {s["id"]: s for s in schema_list}
+
+    # 2. group the events by path, their operations are only generated
+    #    while the spec is written
+    paths = {}
     for e in event_list:
         path = e["topicName"]
         http_method = path.split("/")[0].lower()
@@ -83,41 +273,65 @@ def generateOpenAPISpec(app_name, description, event_list, schema_list):
             # path of OpenAPI MUSH start with "/"
             http_method = "post"
             path = "/"+path
-        
-        operation = {
-            "operationId": e["name"],
-            "description": e["description"],
-            # TODO: responses is required for operation object of Open API
-            # but event of Event Portal do not have such information
-            "responses":{
-                "200": {
-                    "description": "OK",
-                    "content": {
-                        "application/json": {
-                            "schema": {
-                                "type": "string"
-                            }
+        if path not in paths: paths[path] = {}
+        paths[path][http_method] = e
+
+    def generate_schemas():
+        for name, es in json_schemas.items():
+            yield name, json.loads(es["content"])
+
+    def generate_paths():
+        for path, events in paths.items():
+            yield path, {http_method: _generateOperation(e, schemas_by_id, json_schemas) \
+                for http_method, e in events.items()}
+
+    # 3. init the spec
+    spec = {
+        "openapi": "3.0.0",
+        "info": {
+            "title": app_name,
+            "description": description if description else "",
+            "version": "1.0.0"
+        },
+        "components": {
+            "schemas": StreamedMapping(generate_schemas())
+        },
+        "paths": StreamedMapping(generate_paths())
+    }
+
+    # 4. output the spec
+    (writer or SpecWriter(sys.stdout)).write(spec)
+
+def _generateOperation(e, schemas_by_id, json_schemas):
+    operation = {
+        "operationId": e["name"],
+        "description": e["description"],
+        # TODO: responses is required for operation object of Open API
+        # but event of Event Portal do not have such information
+        "responses":{
+            "200": {
+                "description": "OK",
+                "content": {
+                    "application/json": {
+                        "schema": {
+                            "type": "string"
                         }
                     }
                 }
             }
         }
-        if path not in spec["paths"]: spec["paths"][path] = {}
-        spec["paths"][path][http_method] = operation
-
-        if e["schemaId"] == None: continue # no related schema, therefore no request body
-        ep_schema = [s for s in schema_list if s["id"]==e["schemaId"]][0]
-        if not safeget(spec, "components", "schemas", ep_schema["name"]): continue
-        operation["requestBody"] = {
-            "content": {
-                "application/json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/"+ep_schema["name"]
-                    }
+    }
+
+    if e["schemaId"] == None: return operation # no related schema, therefore no request body
+    ep_schema = schemas_by_id.get(e["schemaId"])
+    if not ep_schema or ep_schema["name"] not in json_schemas: return operation
+    operation["requestBody"] = {
+        "content": {
+            "application/json": {
+                "schema": {
+                    "$ref": "#/components/schemas/"+ep_schema["name"]
                 }
             }
         }
-
-
-    # 4. output the spec
-    print(json.dumps(spec, indent=2))
+    }
+    return operation
@@ -0,0 +1,177 @@
+import logging
+import os
+import time
+
+from .batch import ExistenceIndex, default_application, first_line, plan_batch
+from .manifest import Manifest
+from .plan import plan_spec
+
+class Watcher:
+    """Keep specs synced with Event Portal and a queue while they are edited.
+
+    The spec files, and the spec files of directories, are polled every
+    interval seconds. Once a spec didn't change for debounce seconds, it is
+    planned again and only what changed since its previous sync is pushed:
+    the manifest of every spec is kept in memory, so are the parsed specs,
+    the name index of every domain and the pooled connections. What a spec
+    no longer holds is deleted, unless the application of another spec
+    still uses it, see EventPortal._spare_shared.
+
+    The queue, if any, is subscribed on the subscriptions of all specs and
+    only the topics which were added to or removed from them are sent."""
+
+    def __init__(self, paths, loader, make_portal=None, queue_portal=None, mapping=None,
+        domain=None, application=None, pub=None, max_ref_nodes=2000, dedupe=False,
+        interval=0.5, debounce=0.5):
+        self.paths = paths
+        self.loader = loader
+        # make_portal(domain, application, pub, index) returns the EventPortal
+        # of a spec, without it nothing is imported into Event Portal
+        self.make_portal = make_portal
+        self.queue_portal = queue_portal
+        self.mapping = mapping
+        self.domain = domain
+        self.application = application
+        self.pub = pub
+        self.max_ref_nodes = max_ref_nodes
+        self.dedupe = dedupe
+        self.interval = interval
+        self.debounce = debounce
+
+        # spec -> (mtime, size) of its last poll, None once it is gone
+        self._stamps = {}
+        # spec -> {"portal", "manifest", "subscriptions", "synced"} of its syncs
+        self._states = {}
+        # domain -> ExistenceIndex shared by its specs
+        self._indexes = {}
+        # {"topics", "applied"} subscriptions of the last queue sync, the
+        # applied ones are minimized if asked to
+        self._queue = None
+
+    @staticmethod
+    def _stamp(spec):
+        try:
+            st = os.stat(spec)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def poll(self):
+        """Return the (spec, domain, application, pub) jobs of the specs
+        which changed since the previous poll"""
+        jobs = plan_batch(self.paths, self.mapping, self.domain, self.application, self.pub)
+        changed = []
+        for job in jobs:
+            spec = job[0]
+            stamp = self._stamp(spec)
+            if spec in self._stamps and stamp == self._stamps[spec]: continue
+            self._stamps[spec] = stamp
+            if stamp is None:
+                self._gone(spec)
+                continue
+            changed.append(job)
+        for spec in set(self._stamps) - set(job[0] for job in jobs):
+            # e.g. removed from a watched directory
+            if self._stamps.pop(spec) is not None:
+                self._gone(spec)
+        return changed
+
+    def _gone(self, spec):
+        # what it synced is kept, deleting is left to importOpenAPI --prune
+        state = self._states.get(spec)
+        if state and state["subscriptions"] is not None:
+            logging.warning("Spec '{}' is gone, keeping what it synced".format(spec))
+        else:
+            # never planned, it mustn't hold the queue back
+            self._states.pop(spec, None)
+            logging.info("Spec '{}' is gone".format(spec))
+
+    def run(self):
+        """Sync every spec, then every spec once it changed, until interrupted"""
+        pending = {}    # spec -> (job, time of its last change)
+        logging.info("Watching {} every {}s".format(", ".join(self.paths), self.interval))
+        while True:
+            now = time.monotonic()
+            for job in self.poll():
+                pending[job[0]] = (job, now)
+            settled = [job for job, changed_at in pending.values() \
+                if now - changed_at >= self.debounce]
+            if settled:
+                for job in settled:
+                    del pending[job[0]]
+                self.sync(settled)
+            time.sleep(self.interval)
+
+    def sync(self, jobs):
+        """Push the changes of the given specs, then the queue subscriptions"""
+        for spec, domain, application, pub in jobs:
+            start = time.time()
+            state = self._states.get(spec)
+            if state is None:
+                state = self._states[spec] = {"portal": None, "manifest": Manifest(None),
+                    "subscriptions": None, "synced": False}
+            try:
+                plan = plan_spec(self.loader, spec, domain, application, pub,
+                    self.max_ref_nodes, self.dedupe, default_application(spec))
+            except (Exception, SystemExit) as e:
+                # e.g. saved in the middle of an edit, planned again on the next save
+                logging.error("Could not plan '{}': {}".format(spec, first_line(e)))
+                continue
+            state["subscriptions"] = plan["subscriptions"]
+            if self.make_portal is None: continue
+            try:
+                # the one of the plan, a plan file keeps its own target
+                domain = plan["domain"]["name"]
+                if state["portal"] is None:
+                    state["portal"] = self.make_portal(domain, plan["application"]["name"],
+                        plan["application"]["pub"], self._indexes.setdefault(domain, ExistenceIndex()))
+                state["portal"].apply_plan(plan, state["manifest"])
+            except (Exception, SystemExit) as e:
+                logging.error("Sync of '{}' failed: {}".format(spec, first_line(e)))
+                # the next sync of the spec starts over with a full check
+                state.update(portal=None, manifest=Manifest(None), synced=False)
+                self._reset_index(domain)
+                continue
+            # only the first sync reconciles, the manifest tells what changed since
+            state["portal"].reconcile = False
+            if state["synced"]:
+                logging.info("Synced '{}' in {:.2f}s, {:.2f}s after it was saved".format(
+                    spec, time.time() - start, time.time() - self._stamps[spec][0]/1e9))
+            else:
+                logging.info("Synced '{}' in {:.2f}s".format(spec, time.time() - start))
+            state["synced"] = True
+
+        if self.queue_portal is not None:
+            self.sync_queue()
+
+    def _reset_index(self, domain):
+        # the index may be out of date, e.g. with an object created by a
+        # request that timed out, all the specs of the domain page through
+        # its collections again
+        stale = self._indexes.pop(domain, None)
+        if stale is None: return
+        index = self._indexes[domain] = ExistenceIndex()
+        for state in self._states.values():
+            if state["portal"] is not None and state["portal"].index is stale:
+                state["portal"].index = index
+
+    def sync_queue(self):
+        if any(state["subscriptions"] is None for state in self._states.values()):
+            # a partial list of topics would unsubscribe the others with --prune
+            logging.warning("Queue '{}' is synced once every spec could be planned".format(
+                self.queue_portal.queueName))
+            return
+        # all specs subscribe the one queue, in a stable order
+        topics = list(dict.fromkeys(topic for spec in sorted(self._states) \
+            for topic in self._states[spec]["subscriptions"]))
+        if self._queue and topics == self._queue["topics"]: return
+        try:
+            applied = self.queue_portal.syncQueue(topics,
+                self._queue["applied"] if self._queue else None)
+        except (Exception, SystemExit) as e:
+            logging.error("Sync of queue '{}' failed: {}".format(
+                self.queue_portal.queueName, first_line(e)))
+            # listed again on the next sync
+            self._queue = None
+            return
+        self._queue = {"topics": topics, "applied": applied}
@@ -0,0 +1,34 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+@pytest.fixture
+def fake_server():
+    """A local Event Portal/SEMP stand-in, see benchmarks/fake_server.py"""
+    from fake_server import start_server
+    server = start_server()
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def write_spec(tmp_path):
+    """write_spec(name, [(operationId, path, schemaName), ...]) writes an
+    OpenAPI spec of POST operations and returns its path"""
+    def write(name, operations):
+        spec = {"openapi": "3.0.0", "info": {"title": name, "version": "1"},
+            "paths": {}, "components": {"schemas": {}}}
+        for operationId, path, schemaName in operations:
+            spec["paths"][path] = {"post": {"operationId": operationId, "requestBody": {"content": {
+                "application/json": {"schema": {"$ref": "#/components/schemas/"+schemaName}}}}}}
+            spec["components"]["schemas"][schemaName] = {"type": "object",
+                "properties": {schemaName.lower(): {"type": "string"}}}
+        path = tmp_path / (name+".json")
+        path.write_text(json.dumps(spec))
+        return str(path)
+    return write
@@ -0,0 +1,54 @@
+import json
+import threading
+
+import pytest
+
+from sep_tools.EventPortal import EventPortal
+from sep_tools.util import RestError
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode()
+        self.text = self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+class UnauthorizedClient:
+    """Finds no application domain, then answers 401 to every request"""
+
+    def __init__(self):
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self, verb, url, **kwargs):
+        with self.lock:
+            self.requests += 1
+        if url.endswith("/applicationDomains"):
+            return Response(200, {"data": []})
+        return Response(401, {"message": "Unauthorized"})
+
+def test_check_stops_at_the_first_failed_lookup(write_spec):
+    spec = write_spec("many", [("op{}".format(i), "/op/{}".format(i), "S{}".format(i)) for i in range(20)])
+    client = UnauthorizedClient()
+    ep = EventPortal("token", client=client, concurrency=2, bulk_threshold=100)
+    with pytest.raises(RestError):
+        ep.importOpenAPISpec(spec)
+    # the domain, then at most the lookups already running or queued next
+    assert client.requests <= 1 + 2*2
+
+def test_check_looks_up_names_when_the_inventory_is_large(fake_server, write_spec):
+    with fake_server.state.lock:
+        for i in range(300):
+            fake_server.state.ep_new("events", {"name": "other{}".format(i), "applicationDomainId": "other"})
+    spec = write_spec("small", [("createOrder", "/orders", "Order"), ("cancelOrder", "/orders/cancel", "Cancel")])
+    ep = EventPortal("token", base_url=fake_server.url, bulk_threshold=1, page_size=10)
+    ep.importOpenAPISpec(spec, "Shop", "OrderApp")
+
+    requests = fake_server.state.stats()["requests"]
+    # the first page of both inventories, the events inventory spans 30
+    # pages so both events are looked up by name instead
+    assert requests["GET events"] == 1 + 2
+    assert requests["GET schemas"] == 1
+    assert {"createOrder", "cancelOrder"} <= {o["name"] for o in fake_server.state.ep["events"].values()}
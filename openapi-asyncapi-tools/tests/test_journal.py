@@ -0,0 +1,29 @@
+import pytest
+
+from sep_tools.EventPortal import EventPortal
+from sep_tools.journal import Journal
+
+def test_resume_after_reconcile_skips_the_objects_found_up_to_date(fake_server, write_spec, tmp_path):
+    ops = [("createOrder", "/orders", "Order"), ("cancelOrder", "/orders/cancel", "Cancel")]
+    EventPortal("token", base_url=fake_server.url).importOpenAPISpec(
+        write_spec("order", ops), "Shop", "OrderApp")
+    spec = write_spec("order", ops+[("shipOrder", "/orders/ship", "Ship")])
+    journal = str(tmp_path / "order.jsonl")
+
+    def fail(coll_name, obj_name, obj_value):
+        raise RuntimeError("interrupted")
+    ep = EventPortal("token", base_url=fake_server.url, reconcile=True, journal=Journal(journal))
+    ep._post_object = fail
+    with pytest.raises(SystemExit):
+        ep.importOpenAPISpec(spec, "Shop", "OrderApp")
+
+    before = fake_server.state.stats()["requests"]
+    ep = EventPortal("token", base_url=fake_server.url, reconcile=True,
+        journal=Journal(journal, resume=True))
+    ep.importOpenAPISpec(spec, "Shop", "OrderApp")
+    after = fake_server.state.stats()["requests"]
+
+    # only the new event and schema are looked up again
+    assert after["GET events"] - before["GET events"] == 1
+    assert after["GET schemas"] - before["GET schemas"] == 1
+    assert "shipOrder" in {o["name"] for o in fake_server.state.ep["events"].values()}
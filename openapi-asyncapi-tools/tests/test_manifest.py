@@ -0,0 +1,27 @@
+from sep_tools.EventPortal import EventPortal
+from sep_tools.manifest import Manifest
+
+def by_name(server, coll):
+    return {o["name"]: o for o in server.state.ep[coll].values()}
+
+def test_manifest_sync_only_unlinks_what_other_applications_use(fake_server, write_spec, tmp_path):
+    shared = ("updateQuantity", "/cart/quantity", "Quantity")
+    order_ops = [("createOrder", "/orders", "Order"), ("cancelOrder", "/orders/cancel", "Cancel"), shared]
+    manifest = str(tmp_path / "order.manifest.json")
+
+    def import_spec(spec, application, manifest=None):
+        ep = EventPortal("token", base_url=fake_server.url)
+        ep.importOpenAPISpec(spec, "Shop", application, Manifest(manifest) if manifest else None)
+
+    import_spec(write_spec("order", order_ops), "OrderApp", manifest)
+    import_spec(write_spec("browse", [("search", "/search", "Query"), shared]), "BrowseApp")
+    # updateQuantity and cancelOrder are gone from the spec of OrderApp
+    import_spec(write_spec("order", order_ops[:1]), "OrderApp", manifest)
+
+    events, schemas = by_name(fake_server, "events"), by_name(fake_server, "schemas")
+    apps = by_name(fake_server, "applications")
+    assert "cancelOrder" not in events and "Cancel" not in schemas
+    assert "updateQuantity" in events and "Quantity" in schemas
+    assert apps["OrderApp"]["consumedEventIds"] == [events["createOrder"]["id"]]
+    assert events["updateQuantity"]["id"] in apps["BrowseApp"]["consumedEventIds"]
+    assert all(eid in fake_server.state.ep["events"] for eid in apps["BrowseApp"]["consumedEventIds"])
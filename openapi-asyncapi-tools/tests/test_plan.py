@@ -0,0 +1,20 @@
+import json
+
+from sep_tools.plan import Planner, dedupe_schemas
+
+def test_dedupe_keeps_the_named_schema_whatever_its_name():
+    body = {"type": "object", "properties": {"id": {"type": "string"}}}
+    spec = {"openapi": "3.0.0", "info": {"title": "t", "version": "1"},
+        "paths": {}, "components": {"schemas": {"audit_schema": body}}}
+    # the inline body comes first, the named component ends with _schema
+    for operationId, path, schema in (("createOrder", "/orders", body),
+        ("createAudit", "/audits", {"$ref": "#/components/schemas/audit_schema"})):
+        spec["paths"][path] = {"post": {"operationId": operationId, "requestBody": {"content": {
+            "application/json": {"schema": schema}}}}}
+    plan = Planner(json.loads(json.dumps(spec))).plan("Shop", "OrderApp")
+    assert plan["schemas"]["createOrder_schema"]["inline"]
+    assert not plan["schemas"]["audit_schema"]["inline"]
+
+    report = dedupe_schemas(plan)
+    assert report["aliases"] == {"createOrder_schema": "audit_schema"}
+    assert plan["events"]["createOrder"]["schemaName"] == "audit_schema"
@@ -0,0 +1,38 @@
+from sep_tools.resolver import RefResolver
+
+def schemas(**components):
+    return {"components": {"schemas": components}}
+
+def ref(name):
+    return {"$ref": "#/components/schemas/"+name}
+
+def test_cycle_resolves_the_same_whatever_the_order():
+    spec = schemas(
+        A={"type": "object", "properties": {"b": ref("B")}},
+        B={"type": "object", "properties": {"a": ref("A"), "c": ref("C")}},
+        C={"type": "string"},
+    )
+    first = RefResolver(spec)
+    a, b = first.resolve("#/components/schemas/A"), first.resolve("#/components/schemas/B")
+    second = RefResolver(spec)
+    b2, a2 = second.resolve("#/components/schemas/B"), second.resolve("#/components/schemas/A")
+    assert a == a2 and b == b2
+    assert a["properties"]["b"]["properties"]["c"] == {"type": "string"}
+    assert a["properties"]["b"]["properties"]["a"]["description"].startswith("Circular reference")
+    assert b["properties"]["a"]["type"] == "object"
+
+def test_deep_chain_does_not_overflow_the_stack():
+    depth = 5000
+    spec = schemas(**{"S{}".format(i): {"type": "object", "properties": {"next": ref("S{}".format(i+1))}}
+        for i in range(depth)})
+    spec["components"]["schemas"]["S{}".format(depth)] = {"type": "string"}
+    node = RefResolver(spec, max_nodes=0).resolve("#/components/schemas/S0")
+    for _ in range(depth):
+        node = node["properties"]["next"]
+    assert node == {"type": "string"}
+    assert RefResolver(spec).size_of("#/components/schemas/S0")["nodes"] <= 2000
+
+def test_spec_is_not_mutated():
+    spec = schemas(A={"type": "array", "items": ref("B")}, B={"type": "integer"})
+    assert RefResolver(spec).resolve("#/components/schemas/A") == {"type": "array", "items": {"type": "integer"}}
+    assert spec["components"]["schemas"]["A"]["items"] == ref("B")
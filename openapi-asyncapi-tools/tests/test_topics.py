@@ -0,0 +1,35 @@
+from sep_tools.topics import TopicMinimizer
+
+CUSTOMER = ["GET/v1/customers/{id}", "PUT/v1/customers/{id}", "DELETE/v1/customers/{id}"]
+
+def test_methods_collapse_into_a_wildcard_within_the_budget():
+    # */v1/customers/{id} also matches the 5 other HTTP methods
+    assert TopicMinimizer(CUSTOMER, max_extra=4).minimize() == sorted(CUSTOMER)
+    minimizer = TopicMinimizer(CUSTOMER, max_extra=5)
+    assert minimizer.minimize() == ["*/v1/customers/{id}"]
+    (pattern, covered, extras), = minimizer.merges
+    assert len(covered) == 3 and len(extras) == 5
+
+def test_path_levels_never_collapse():
+    topics = ["GET/v1/customers/{id}", "GET/v1/orders/{id}"]
+    assert TopicMinimizer(topics, max_extra=100).minimize() == sorted(topics)
+
+def test_existing_wildcard_drops_what_it_matches():
+    topics = ["*/v1/customers/{id}"] + CUSTOMER
+    assert TopicMinimizer(topics).minimize() == ["*/v1/customers/{id}"]
+
+def test_multi_level_needs_the_flag_and_a_shared_prefix():
+    topics = ["POST/v1/orders/created", "POST/v1/orders/cancelled/reason"]
+    assert TopicMinimizer(topics).minimize() == sorted(topics)
+    assert TopicMinimizer(topics, multi_level=True).minimize() == ["POST/v1/orders/>"]
+    short = ["POST/v1", "POST/v2/x"]
+    assert TopicMinimizer(short, multi_level=True, min_prefix=2).minimize() == sorted(short)
+
+def test_multi_level_respects_the_budget():
+    # POST/v1/orders/> also matches the known POST/v1/orders/a/y and b/x
+    topics = ["POST/v1/orders/a/x", "POST/v1/orders/b/y"]
+    assert TopicMinimizer(topics, max_extra=1, multi_level=True).minimize() == sorted(topics)
+    minimizer = TopicMinimizer(topics, max_extra=2, multi_level=True)
+    assert minimizer.minimize() == ["POST/v1/orders/>"]
+    assert [e for _, _, e in minimizer.merges] == [[("POST", "v1", "orders", "a", "y"),
+        ("POST", "v1", "orders", "b", "x")]]
@@ -0,0 +1,31 @@
+import logging
+
+from sep_tools.EventPortal import EventPortal
+from sep_tools.loader import SpecLoader
+from sep_tools.watch import Watcher
+
+def test_watch_keeps_an_event_another_spec_links(fake_server, write_spec, tmp_path, caplog):
+    shared = ("updateQuantity", "/cart/quantity", "Quantity")
+    order = write_spec("order", [("createOrder", "/orders", "Order"), shared])
+    browse = write_spec("browse", [("search", "/search", "Query"), shared])
+    loader = SpecLoader()
+    watcher = Watcher([str(tmp_path)], loader, lambda domain, application, pub, index=None: \
+        EventPortal("token", pub, loader=loader, base_url=fake_server.url, index=index),
+        domain="Shop")
+
+    watcher.sync(watcher.poll())
+    write_spec("order", [("createOrder", "/orders", "Order")])
+    watcher.sync(watcher.poll())
+    # a change of the other spec is still synced incrementally
+    write_spec("browse", [("search", "/search", "Query"), shared, ("browse", "/browse", "Query")])
+    with caplog.at_level(logging.ERROR):
+        watcher.sync(watcher.poll())
+
+    assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
+    events = {e["name"]: e for e in fake_server.state.ep["events"].values()}
+    apps = {a["name"]: a for a in fake_server.state.ep["applications"].values()}
+    assert "Quantity" in {s["name"] for s in fake_server.state.ep["schemas"].values()}
+    assert events["updateQuantity"]["id"] in apps["browse"]["consumedEventIds"]
+    assert events["updateQuantity"]["id"] not in apps["order"]["consumedEventIds"]
+    assert all(eid in fake_server.state.ep["events"] for eid in apps["browse"]["consumedEventIds"])
+    assert all(state["synced"] for state in watcher._states.values())